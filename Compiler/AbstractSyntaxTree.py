@@ -1,34 +1,57 @@
-from rply.token import BaseBox
-from .JSONparsedTree import Node
+import math
+import re
+from .JSONparsedTree import Node, leaf, shared
 from .errors import *
 
+try:
+    import numpy
+except ImportError:  # Only array values need NumPy, scalar programs run without it !
+    numpy = None
 
-# All token types inherit rply's basebox as rpython needs this
+
+# Exact types only, bool isn't a number for the builtins !
+NUMBERS = (int, float)
+# Text typed at an input() prompt which is read as a number !
+NUMERIC = re.compile(r'^-?\d+(\.\d+)?$')
+
+
+def is_array(value):
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+class BaseBox(object):
+    # Same role as rply's BaseBox, but with __slots__ so the AST nodes carry no per-instance __dict__ !
+    __slots__ = ()
+
+
+# All token types inherit the basebox above, like rply's one as rpython needs this
 # These classes represent our Abstract Syntax Tree
 # TODO: deprecate eval(env) as we move to compiling and then interpreting
 
 class Program(BaseBox):
-    def __init__(self, statement, program, state):
+    __slots__ = ('state', 'statements')
+
+    def __init__(self, statement, state):
+        # Later statements are appended by add_statement(), the grammar being left recursive !
         self.state = state
-        if type(program) is Program:
-            self.statements = program.get_statements()
-            self.statements.insert(0, statement)
-        else:
-            self.statements = [statement]
+        self.statements = [statement]
 
     def add_statement(self, statement):
-        self.statements.insert(0, statement)
+        self.statements.append(statement)
 
     def get_statements(self):
         return self.statements
 
     def eval(self, node):
         # print("Program<%s> statement's counter: %s" % (self, len(self.statements)))
+        budget = self.state.budget
         result = None
         for i, statement in enumerate(self.statements):
+            if budget is not None and not i % budget.CHECK_EVERY:
+                budget.step(min(budget.CHECK_EVERY, len(self.statements) - i), traced=True)
             left = Node('statement_full')
             right = Node('program')
-            # If last statement then stop appending Node("program") to the right !
+            # If last statement then stop appending leaf("program") to the right !
             if i == len(self.statements) - 1:
                 node.children.extend([left])
             else:
@@ -38,6 +61,20 @@ class Program(BaseBox):
             result = statement.eval(left)
         return result  # The result is not been used yet !
 
+    def run(self):
+        # Same as eval(node) but without building the semantic tree !
+        budget = self.state.budget
+        if budget is not None:
+            # Charged inline, Budget.run() takes over once a check is due (always for over CHECK_EVERY statements) !
+            budget.steps += len(self.statements)
+            if budget.steps >= budget.until:
+                budget.steps -= len(self.statements)
+                return budget.run(self.statements)
+        result = None
+        for statement in self.statements:
+            result = statement.run()
+        return result
+
     def rep(self):
         result = 'Program('
         for statement in self.statements:
@@ -45,29 +82,37 @@ class Program(BaseBox):
         result += '\n)'
         return result
 
+    def syntax(self):
+        # Derive the right-recursive "statement_full program" chain from the flat statement list !
+        children = [Node("statement_full", self.statements[-1].syntax())]
+        for statement in reversed(self.statements[:-1]):
+            children = [Node("statement_full", statement.syntax()), Node("program", children)]
+        return children
+
 
 class Block(BaseBox):
-    def __init__(self, statement, block, state):
+    __slots__ = ('state', 'statements')
+
+    def __init__(self, statement, state):
         self.state = state
-        if type(block) is Block:
-            self.statements = block.get_statements()
-            self.statements.insert(0, statement)
-        else:
-            self.statements = [statement]
+        self.statements = [statement]
 
     def add_statement(self, statement):
-        self.statements.insert(0, statement)
+        self.statements.append(statement)
 
     def get_statements(self):
         return self.statements
 
     def eval(self, node):
         # print("Block<%s> statement's counter: %s" % (self, len(self.statements)))
+        budget = self.state.budget
         result = None
         for i, statement in enumerate(self.statements):
+            if budget is not None and not i % budget.CHECK_EVERY:
+                budget.step(min(budget.CHECK_EVERY, len(self.statements) - i), traced=True)
             left = Node('statement_full')
             right = Node('block')
-            # If last statement then stop appending Node("block") to the right !
+            # If last statement then stop appending leaf("block") to the right !
             if i == len(self.statements) - 1:
                 node.children.extend([left])
             else:
@@ -77,6 +122,20 @@ class Block(BaseBox):
             result = statement.eval(left)
         return result  # The result is not been used yet !
 
+    def run(self):
+        # Same as eval(node) but without building the semantic tree !
+        budget = self.state.budget
+        if budget is not None:
+            # Charged inline, Budget.run() takes over once a check is due (always for over CHECK_EVERY statements) !
+            budget.steps += len(self.statements)
+            if budget.steps >= budget.until:
+                budget.steps -= len(self.statements)
+                return budget.run(self.statements)
+        result = None
+        for statement in self.statements:
+            result = statement.run()
+        return result
+
     def rep(self):
         result = 'Block('
         for statement in self.statements:
@@ -84,8 +143,17 @@ class Block(BaseBox):
         result += '\n)'
         return result
 
+    def syntax(self):
+        # Derive the right-recursive "statement_full block" chain from the flat statement list !
+        children = [Node("statement_full", self.statements[-1].syntax())]
+        for statement in reversed(self.statements[:-1]):
+            children = [Node("statement_full", statement.syntax()), Node("block", children)]
+        return children
+
 
 class If(BaseBox):
+    __slots__ = ('condition', 'body', 'else_body', 'state')
+
     def __init__(self, condition, body, else_body=None, state=None):
         self.condition = condition
         self.body = body
@@ -94,14 +162,14 @@ class If(BaseBox):
 
     def eval(self, node):
         expression = Node("expression")
-        node.children.extend([Node("IF"), Node("("), expression, Node(")")])
+        node.children.extend([leaf("IF"), leaf("("), expression, leaf(")")])
         condition = self.condition.eval(expression)
         block = Node("block")
-        node.children.extend([Node("{"), block, Node("}")])
+        node.children.extend([leaf("{"), block, leaf("}")])
         else_block = Node("block")
         if self.else_body is not None:
             node.children.extend(
-                [Node("else"), Node("{"), else_block, Node("}")])
+                [leaf("else"), leaf("{"), else_block, leaf("}")])
         if bool(condition) is True:
             return self.body.eval(block)
         else:
@@ -109,15 +177,34 @@ class If(BaseBox):
                 return self.else_body.eval(else_block)
         return None
 
+    def run(self):
+        if bool(self.condition.run()) is True:
+            return self.body.run()
+        elif self.else_body is not None:
+            return self.else_body.run()
+        return None
+
     def rep(self):
         return 'If(%s) Then(%s) Else(%s)' % (self.condition.rep(), self.body.rep(), self.else_body.rep())
 
+    def syntax(self):
+        children = [leaf("IF"), leaf("("), Node("expression", self.condition.syntax()), leaf(")"),
+                    leaf("{"), Node("block", self.body.syntax()), leaf("}")]
+        if self.else_body is not None:
+            children.extend([leaf("ELSE"), leaf("{"), Node("block", self.else_body.syntax()), leaf("}")])
+        return children
+
 
 class Variable(BaseBox):
-    def __init__(self, name, state):
+    __slots__ = ('name', 'value', 'state', 'token', 'slot')
+
+    def __init__(self, name, state, token=None):
         self.name = str(name)
         self.value = None
         self.state = state
+        self.token = token
+        # Resolved once here, every read and write afterwards is a list index !
+        self.slot = state.slot(self.name)
 
     def get_name(self):
         return str(self.name)
@@ -125,12 +212,18 @@ class Variable(BaseBox):
     def eval(self, node):
         identifier = Node("IDENTIFIER")
         node.children.extend([identifier])
-        if dict(self.state.variables).get(self.name) is not None:
-            self.value = self.state.variables[self.name]
-            identifier.children.extend([Node(self.name, [Node(self.value)])])
+        if self.state.values[self.slot] is not None:
+            self.value = self.state.values[self.slot]
+            identifier.children.extend([shared(self.name, leaf(self.value))])
             return self.value
         identifier.children.extend(
-            [Node("Variable <%s> is not yet defined" % str(self.name))])
+            [leaf("Variable <%s> is not yet defined" % str(self.name))])
+        raise LogicError("Variable <%s> is not yet defined" % str(self.name))
+
+    def run(self):
+        value = self.state.values[self.slot]
+        if value is not None:
+            return value
         raise LogicError("Variable <%s> is not yet defined" % str(self.name))
 
     def to_string(self):
@@ -139,138 +232,239 @@ class Variable(BaseBox):
     def rep(self):
         return 'Variable(%s)' % self.name
 
+    def syntax(self):
+        return [Node("IDENTIFIER", self.token)]
+
 
 class FunctionDeclaration(BaseBox):
-    def __init__(self, name, args, block, state):
+    __slots__ = ('name', 'args', 'block', 'token')
+
+    def __init__(self, name, args, block, state, token=None):
         self.name = name
         self.args = args
         self.block = block
+        self.token = token
         state.functions[self.name] = self
 
     def eval(self, node):
-        identifier = Node(self.name)
+        identifier = leaf(self.name)
         node.children.extend(
-            [Node("FUNCTION"), identifier, Node("{"), Node("block"), Node("}")])
+            [leaf("FUNCTION"), identifier, leaf("{"), leaf("block"), leaf("}")])
+        return self
+
+    def run(self):
         return self
 
     def to_string(self):
         return "<function '%s'>" % self.name
 
+    def syntax(self):
+        return [leaf("FUNCTION"), Node("IDENTIFIER", self.token), leaf("("), leaf(")"),
+                leaf("{"), Node("block", self.block.syntax()), leaf("}")]
+
 
 class CallFunction(BaseBox):
-    def __init__(self, name, args, state):
+    __slots__ = ('name', 'args', 'state', 'token')
+
+    def __init__(self, name, args, state, token=None):
         self.name = name
         self.args = args
         self.state = state
+        self.token = token
 
     def eval(self, node):
         identifier = Node(self.name + " ( )")
         node.children.extend([identifier])
-        return self.state.functions[self.name].block.eval(identifier)
+        budget = self.state.budget
+        if budget is None:
+            return self.call(identifier)
+        budget.depth += 1
+        if budget.depth > budget.deepest:
+            budget.enter()
+        result = self.call(identifier)
+        budget.depth -= 1
+        return result
+
+    def run(self):
+        state = self.state
+        budget = state.budget
+        if budget is None:
+            return self.call()
+        # Budget.enter() inlined, a failing call ends the run (start() resets the depth) so no finally is needed !
+        budget.depth += 1
+        if state.memo is not None:
+            if budget.depth > budget.deepest:
+                budget.enter()
+            result = self.call()
+        else:
+            # The body's statements are charged along, one test tells whether Budget has anything to check !
+            block = state.functions[self.name].block
+            budget.steps += len(block.statements)
+            if budget.depth > budget.deepest or budget.steps >= budget.until:
+                budget.steps -= len(block.statements)
+                budget.enter()
+                result = block.run()
+            else:
+                result = None
+                for statement in block.statements:
+                    result = statement.run()
+        budget.depth -= 1
+        return result
+
+    def call(self, identifier=None):
+        # Run the function's block, tracing it under `identifier` when there's one !
+        function = self.state.functions[self.name]
+        if identifier is None:
+            if self.state.memo is not None:
+                return self.state.memo.run(function)
+            return function.block.run()
+        if self.state.memo is not None:
+            return self.state.memo.eval(function, identifier)
+        return function.block.eval(identifier)
 
     def to_string(self):
         return "<call '%s'>" % self.name
 
+    def syntax(self):
+        return [Node("IDENTIFIER", self.token), leaf("("), leaf(")")]
+
 
 class BaseFunction(BaseBox):
+    __slots__ = ('expression', 'value', 'state')
+    keyword = None  # Token type of the builtin, used by syntax() !
+    roundOffDigits = 10
+
     def __init__(self, expression, state):
         self.expression = expression
         self.value = None
         self.state = state
-        self.roundOffDigits = 10
 
     def eval(self, node):
         raise NotImplementedError(
             "This is abstract method from abstract class BaseFunction(BaseBox){...} !")
 
+    def run(self):
+        return self.apply(self.expression.run())
+
+    def apply(self, value):
+        # Compute the builtin on already evaluated arguments, shared by every backend !
+        raise NotImplementedError(
+            "This is abstract method from abstract class BaseFunction(BaseBox){...} !")
+
     def to_string(self):
         return str(self.value)
 
     def rep(self):
         return 'BaseFunction(%s)' % self.value
 
+    def syntax(self):
+        return [leaf(self.keyword), leaf("("), Node("expression", self.expression.syntax()), leaf(")")]
+
 
 class Absolute(BaseFunction):
+    __slots__ = ()
+    keyword = "ABSOLUTE"
+
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
     def eval(self, node):
-        import re as regex
         expression = Node("expression")
-        node.children.extend([Node("ABSOLUTE"), Node(
-            "("), expression, Node(")"), Node(";")])
-        self.value = self.expression.eval(expression)
-        if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
-            self.value = abs(self.value)
-            return self.value
-        else:
-            raise ValueError("Cannot abs() not numerical values !")
+        node.children.extend([leaf("ABSOLUTE"), leaf("("), expression, leaf(")"), leaf(";")])
+        self.value = self.apply(self.expression.eval(expression))
+        return self.value
+
+    def apply(self, value):
+        # Typed dispatch, used when the type inference couldn't tell the type of the argument !
+        if type(value) in NUMBERS:
+            return abs(value)
+        if is_array(value):
+            return numpy.abs(value)
+        raise ValueError("Cannot abs() not numerical values !")
 
     def rep(self):
         return 'Absolute(%s)' % self.value
 
 
 class Sin(BaseFunction):
+    __slots__ = ()
+    keyword = "SIN"
+
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
     def eval(self, node):
-        import re as regex
         expression = Node("expression")
-        node.children.extend([Node("SIN"), Node("("), expression, Node(")")])
-        self.value = self.expression.eval(expression)
-        if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
-            import math
-            self.value = round(math.sin(self.value), self.roundOffDigits)
-            return self.value
-        else:
-            raise ValueError("Cannot sin() not numerical values !")
+        node.children.extend([leaf("SIN"), leaf("("), expression, leaf(")")])
+        self.value = self.apply(self.expression.eval(expression))
+        return self.value
+
+    def apply(self, value):
+        if type(value) in NUMBERS:
+            return round(math.sin(value), self.roundOffDigits)
+        if is_array(value):
+            # One ufunc & one rounding over the whole array !
+            return numpy.round(numpy.sin(value), self.roundOffDigits)
+        raise ValueError("Cannot sin() not numerical values !")
 
     def rep(self):
         return 'Sin(%s)' % self.value
 
 
 class Cos(BaseFunction):
+    __slots__ = ()
+    keyword = "COS"
+
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
     def eval(self, node):
-        import re as regex
         expression = Node("expression")
-        node.children.extend([Node("COS"), Node("("), expression, Node(")")])
-        self.value = self.expression.eval(expression)
-        if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
-            import math
-            self.value = round(math.cos(self.value), self.roundOffDigits)
-            return self.value
-        else:
-            raise ValueError("Cannot cos() not numerical values !")
+        node.children.extend([leaf("COS"), leaf("("), expression, leaf(")")])
+        self.value = self.apply(self.expression.eval(expression))
+        return self.value
+
+    def apply(self, value):
+        if type(value) in NUMBERS:
+            return round(math.cos(value), self.roundOffDigits)
+        if is_array(value):
+            # One ufunc & one rounding over the whole array !
+            return numpy.round(numpy.cos(value), self.roundOffDigits)
+        raise ValueError("Cannot cos() not numerical values !")
 
     def rep(self):
         return 'Cos(%s)' % self.value
 
 
 class Tan(BaseFunction):
+    __slots__ = ()
+    keyword = "TAN"
+
     def __init__(self, expression, state):
         super().__init__(expression, state)
 
     def eval(self, node):
-        import re as regex
         expression = Node("expression")
-        node.children.extend([Node("TAN"), Node("("), expression, Node(")")])
-        self.value = self.expression.eval(expression)
-        if regex.search('^-?\d+(\.\d+)?$', str(self.value)):
-            import math
-            self.value = round(math.tan(self.value), self.roundOffDigits)
-            return self.value
-        else:
-            raise ValueError("Cannot tan() not numerical values !")
+        node.children.extend([leaf("TAN"), leaf("("), expression, leaf(")")])
+        self.value = self.apply(self.expression.eval(expression))
+        return self.value
+
+    def apply(self, value):
+        if type(value) in NUMBERS:
+            return round(math.tan(value), self.roundOffDigits)
+        if is_array(value):
+            # One ufunc & one rounding over the whole array !
+            return numpy.round(numpy.tan(value), self.roundOffDigits)
+        raise ValueError("Cannot tan() not numerical values !")
 
     def rep(self):
         return 'Tan(%s)' % self.value
 
 
 class Pow(BaseFunction):
+    __slots__ = ('expression2', 'value2')
+    keyword = "POWER"
+
     def __init__(self, expression, expression2, state):
         super().__init__(expression, state)
         self.expression2 = expression2
@@ -279,47 +473,65 @@ class Pow(BaseFunction):
     def eval(self, node):
         expression = Node("expression")
         expression2 = Node("expression")
-        node.children.extend([Node("POWER"), Node(
-            "("), expression, Node(","), expression2, Node(")")])
+        node.children.extend([leaf("POWER"), leaf("("), expression, leaf(","), expression2, leaf(")")])
         self.value = self.expression.eval(expression)
         self.value2 = self.expression2.eval(expression2)
-        import re as regex
-        match1 = regex.search('^-?\d+(\.\d+)?$', str(self.value))
-        match2 = regex.search('^-?\d+(\.\d+)?$', str(self.value2))
-        if match1 and match2:
-            import math
-            self.value = math.pow(self.value, self.value2)
-            return self.value
-        else:
-            raise ValueError("Cannot pow() not numerical values !")
+        self.value = self.apply(self.value, self.value2)
+        return self.value
+
+    def run(self):
+        return self.apply(self.expression.run(), self.expression2.run())
+
+    def apply(self, value, value2):
+        if type(value) in NUMBERS and type(value2) in NUMBERS:
+            return math.pow(value, value2)
+        if is_array(value) or is_array(value2):
+            return numpy.power(numpy.asarray(value, dtype=float), value2)
+        raise ValueError("Cannot pow() not numerical values !")
 
     def rep(self):
         return 'Pow(%s)' % self.value
 
+    def syntax(self):
+        return [leaf(self.keyword), leaf("("), Node("expression", self.expression.syntax()), leaf(","),
+                Node("expression", self.expression2.syntax()), leaf(")")]
+
 
 # ABSTRACT CLASS! DO NOT USE!
 class Constant(BaseBox):
-    def __init__(self, state):
+    __slots__ = ('value', 'state', 'token')
+
+    def __init__(self, state, token=None):
         self.value = None
         self.state = state
+        self.token = token
 
     def eval(self, node):
-        value = Node(self.value)
-        typed = Node(self.__class__.__name__.upper(), [value])
-        constant = Node("const", [typed])
+        # The same constant always traces to the same subtree, so it's shared !
+        value = leaf(self.value)
+        typed = shared(self.__class__.__name__.upper(), value)
+        constant = shared("const", typed)
         node.children.extend([constant])
         return self.value
 
+    def run(self):
+        return self.value
+
     def to_string(self):
         return str(self.value)
 
     def rep(self):
         return 'Constant(%s)' % self.value
 
+    def syntax(self):
+        return [Node("const", [Node(self.token.gettokentype(), self.token)])]
+
 
 class Boolean(Constant):
-    def __init__(self, value, state):
-        super().__init__(state)
+    __slots__ = ()
+
+    def __init__(self, value, state, token=None):
+        super().__init__(state, token)
         if ["true", "false", "True", "False", "TRUE", "FALSE", ].__contains__(value):
             if value.lower().__eq__("true"):
                 self.value = True
@@ -334,8 +546,10 @@ class Boolean(Constant):
 
 
 class Integer(Constant):
-    def __init__(self, value, state):
-        super().__init__(state)
+    __slots__ = ()
+
+    def __init__(self, value, state, token=None):
+        super().__init__(state, token)
         self.value = int(value)
 
     def rep(self):
@@ -343,8 +557,10 @@ class Integer(Constant):
 
 
 class Float(Constant):
-    def __init__(self, value, state):
-        super().__init__(state)
+    __slots__ = ()
+
+    def __init__(self, value, state, token=None):
+        super().__init__(state, token)
         self.value = float(value)
 
     def rep(self):
@@ -352,8 +568,10 @@ class Float(Constant):
 
 
 class String(Constant):
-    def __init__(self, value, state):
-        super().__init__(state)
+    __slots__ = ()
+
+    def __init__(self, value, state, token=None):
+        super().__init__(state, token)
         self.value = str(value)
 
     def to_string(self):
@@ -364,8 +582,10 @@ class String(Constant):
 
 
 class ConstantPI(Constant):
-    def __init__(self, name, state):
-        super().__init__(state)
+    __slots__ = ('name',)
+
+    def __init__(self, name, state, token=None):
+        super().__init__(state, token)
         import math
         self.name = str(name)
         if str(name).__contains__('-'):
@@ -378,8 +598,10 @@ class ConstantPI(Constant):
 
 
 class ConstantE(Constant):
-    def __init__(self, name, state):
-        super().__init__(state)
+    __slots__ = ('name',)
+
+    def __init__(self, name, state, token=None):
+        super().__init__(state, token)
         import math
         self.name = str(name)
         if str(name).__contains__('-'):
@@ -392,25 +614,32 @@ class ConstantE(Constant):
 
 
 class BinaryOp(BaseBox):
+    __slots__ = ('left', 'right', 'state')
+    symbol = None  # Operator token as shown in the syntax tree !
+
     def __init__(self, left, right, state):
         self.left = left
         self.right = right
         self.state = state
 
+    def syntax(self):
+        return [Node("expression", self.left.syntax()), leaf(self.symbol), Node("expression", self.right.syntax())]
+
 
 class Assignment(BinaryOp):
+    __slots__ = ()
+
     def eval(self, node):
         if isinstance(self.left, Variable):
             var_name = self.left.get_name()
-            if dict(self.state.variables).get(var_name) is None:
-                identifier = Node("IDENTIFIER", [Node(var_name)])
+            if self.state.values[self.left.slot] is None:
+                identifier = shared("IDENTIFIER", leaf(var_name))
                 expression = Node("expression")
                 node.children.extend(
-                    [Node("LET"), identifier, Node("="), expression])
-                self.state.variables[var_name] = self.right.eval(expression)
-                # print(self.state.variables)
-                # Return the ParserState() that hold the variables.
-                return self.state.variables
+                    [leaf("LET"), identifier, leaf("="), expression])
+                self.state.values[self.left.slot] = self.right.eval(expression)
+                # Return the assigned value, building the whole variables dict here would cost O(n) !
+                return self.state.values[self.left.slot]
 
             # Otherwise raise error
             raise ImmutableError(var_name)
@@ -418,188 +647,424 @@ class Assignment(BinaryOp):
         else:
             raise LogicError("Cannot assign to <%s>" % self)
 
+    def run(self):
+        if isinstance(self.left, Variable):
+            var_name = self.left.get_name()
+            if self.state.values[self.left.slot] is None:
+                self.state.values[self.left.slot] = self.right.run()
+                return self.state.values[self.left.slot]
+            raise ImmutableError(var_name)
+        else:
+            raise LogicError("Cannot assign to <%s>" % self)
+
     def rep(self):
         return 'Assignment(%s, %s)' % (self.left.rep(), self.right.rep())
 
+    def syntax(self):
+        return [leaf("LET"), Node("IDENTIFIER", self.left.token), leaf("="), Node("expression", self.right.syntax())]
+
 
 class Sum(BinaryOp):
+    __slots__ = ()
+    symbol = "+"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("+"), right])
+        node.children.extend([left, leaf("+"), right])
         return self.left.eval(left) + self.right.eval(right)
 
+    def run(self):
+        return self.left.run() + self.right.run()
+
 
 class Sub(BinaryOp):
+    __slots__ = ()
+    symbol = "-"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("-"), right])
+        node.children.extend([left, leaf("-"), right])
         return self.left.eval(left) - self.right.eval(right)
 
+    def run(self):
+        return self.left.run() - self.right.run()
+
 
 class Mul(BinaryOp):
+    __slots__ = ()
+    symbol = "*"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("*"), right])
+        node.children.extend([left, leaf("*"), right])
         return self.left.eval(left) * self.right.eval(right)
 
+    def run(self):
+        return self.left.run() * self.right.run()
+
 
 class Div(BinaryOp):
+    __slots__ = ()
+    symbol = "/"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("/"), right])
+        node.children.extend([left, leaf("/"), right])
         return self.left.eval(left) / self.right.eval(right)
 
+    def run(self):
+        return self.left.run() / self.right.run()
+
 
 class Equal(BinaryOp):
+    __slots__ = ()
+    symbol = "=="
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("=="), right])
+        node.children.extend([left, leaf("=="), right])
         return self.left.eval(left) == self.right.eval(right)
 
+    def run(self):
+        return self.left.run() == self.right.run()
+
 
 class NotEqual(BinaryOp):
+    __slots__ = ()
+    symbol = "!="
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("!="), right])
+        node.children.extend([left, leaf("!="), right])
         return self.left.eval(left) != self.right.eval(right)
 
+    def run(self):
+        return self.left.run() != self.right.run()
+
 
 class GreaterThan(BinaryOp):
+    __slots__ = ()
+    symbol = ">"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node(">"), right])
+        node.children.extend([left, leaf(">"), right])
         return self.left.eval(left) > self.right.eval(right)
 
+    def run(self):
+        return self.left.run() > self.right.run()
+
 
 class LessThan(BinaryOp):
+    __slots__ = ()
+    symbol = "<"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("<"), right])
+        node.children.extend([left, leaf("<"), right])
         return self.left.eval(left) < self.right.eval(right)
 
+    def run(self):
+        return self.left.run() < self.right.run()
+
 
 class GreaterThanEqual(BinaryOp):
+    __slots__ = ()
+    symbol = ">="
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node(">="), right])
+        node.children.extend([left, leaf(">="), right])
         return self.left.eval(left) >= self.right.eval(right)
 
+    def run(self):
+        return self.left.run() >= self.right.run()
+
 
 class LessThanEqual(BinaryOp):
+    __slots__ = ()
+    symbol = "<="
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("<="), right])
+        node.children.extend([left, leaf("<="), right])
         return self.left.eval(left) <= self.right.eval(right)
 
+    def run(self):
+        return self.left.run() <= self.right.run()
+
 
 class And(BinaryOp):
+    __slots__ = ()
+    symbol = "AND"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("and"), right])
+        node.children.extend([left, leaf("and"), right])
         return self.left.eval(left) and self.right.eval(right)
 
+    def run(self):
+        return self.left.run() and self.right.run()
+
 
 class Or(BinaryOp):
+    __slots__ = ()
+    symbol = "OR"
+
     def eval(self, node):
         left = Node("expression")
         right = Node("expression")
-        node.children.extend([left, Node("or"), right])
+        node.children.extend([left, leaf("or"), right])
         return self.left.eval(left) or self.right.eval(right)
 
+    def run(self):
+        return self.left.run() or self.right.run()
+
+
+class Array(BaseBox):
+    __slots__ = ('elements', 'value', 'state')
+
+    def __init__(self, element, state):
+        self.elements = [element]
+        self.value = None
+        self.state = state
+
+    def add_element(self, element):
+        self.elements.append(element)
+
+    def eval(self, node):
+        elements = Node("elements")
+        node.children.extend([leaf("["), elements, leaf("]")])
+        values = []
+        for i, element in enumerate(self.elements):
+            if i != 0:
+                elements.children.append(leaf(","))
+            expression = Node("expression")
+            elements.children.append(expression)
+            values.append(element.eval(expression))
+        self.value = self.apply(*values)
+        return self.value
+
+    def run(self):
+        return self.apply(*[element.run() for element in self.elements])
+
+    def apply(self, *values):
+        if numpy is None:
+            raise LogicError("Array values need NumPy, which is not installed !")
+        value = numpy.array(values)
+        if value.dtype.kind not in "biuf":
+            raise ValueError("Cannot make an array of not numerical values !")
+        return value
+
+    def rep(self):
+        return 'Array(%s)' % self.value
+
+    def syntax(self):
+        # Derive the left-recursive "elements , expression" chain from the flat element list !
+        children = [Node("expression", self.elements[0].syntax())]
+        for element in self.elements[1:]:
+            children = [Node("elements", children), leaf(","), Node("expression", element.syntax())]
+        return [leaf("["), Node("elements", children), leaf("]")]
+
 
 class Not(BaseBox):
+    __slots__ = ('expression', 'value', 'state')
+
     def __init__(self, expression, state):
-        self.value = expression
+        self.expression = expression
+        self.value = None
         self.state = state
 
     def eval(self, node):
         expression = Node("expression")
-        node.children.extend([Node("Not"), expression])
-        self.value = self.value.eval(expression)
-        if isinstance(self.value, bool):
-            return not bool(self.value)
+        node.children.extend([leaf("Not"), expression])
+        self.value = self.apply(self.expression.eval(expression))
+        return self.value
+
+    def run(self):
+        return self.apply(self.expression.run())
+
+    def apply(self, value):
+        if isinstance(value, bool):
+            return not bool(value)
+        if is_array(value) and value.dtype == bool:
+            return numpy.logical_not(value)
         raise LogicError("Cannot 'not' that")
 
+    def syntax(self):
+        return [leaf("NOT"), Node("expression", self.expression.syntax())]
+
 
 class Print(BaseBox):
+    __slots__ = ('value', 'state')
+
     def __init__(self, expression=None, state=None):
         self.value = expression
         self.state = state
 
     def eval(self, node):
-        node.children.extend([Node("PRINT"), Node("(")])
+        node.children.extend([leaf("PRINT"), leaf("(")])
         if self.value is None:
-            print()
+            self.apply()
         else:
             expression = Node("expression")
             node.children.extend([expression])
-            print(self.value.eval(expression))
-        node.children.extend([Node(")")])
+            self.apply(self.value.eval(expression))
+        node.children.extend([leaf(")")])
+
+    def run(self):
+        if self.value is None:
+            self.apply()
+        else:
+            self.apply(self.value.run())
+
+    def apply(self, *value):
+        output = self.state.output if self.state is not None else None
+        text = " ".join(map(str, value))
+        if self.state is not None and self.state.budget is not None:
+            self.state.budget.write(len(text) + 1)
+        if output is None:
+            print(text)
+        else:
+            output.write(text + "\n")
+
+    def syntax(self):
+        if self.value is None:
+            return [leaf("PRINT"), leaf("("), leaf(")")]
+        return [leaf("PRINT"), leaf("("), Node("expression", self.value.syntax()), leaf(")")]
 
 
 class Input(BaseBox):
+    __slots__ = ('value', 'state')
+
     def __init__(self, expression=None, state=None):
         self.value = expression
         self.state = state
 
     def eval(self, node):
-        node.children.extend([Node("CONSOLE_INPUT"), Node("(")])
+        node.children.extend([leaf("CONSOLE_INPUT"), leaf("(")])
         if self.value is None:
-            result = input()
+            result = self.apply()
         else:
             expression = Node("expression")
             node.children.extend([expression])
-            result = input(self.value.eval(expression))
-        node.children.extend([Node(")")])
-        import re as regex
-        if regex.search('^-?\d+(\.\d+)?$', str(result)):
+            result = self.apply(self.value.eval(expression))
+        node.children.extend([leaf(")")])
+        return result
+
+    def run(self):
+        if self.value is None:
+            return self.apply()
+        return self.apply(self.value.run())
+
+    def apply(self, *prompt):
+        output = self.state.output if self.state is not None else None
+        read = self.state.input if self.state is not None and self.state.input is not None else input
+        if self.state is not None and self.state.budget is not None:
+            self.state.budget.write(sum(len(str(part)) for part in prompt))
+        if output is None:
+            result = read(*prompt)
+        else:
+            # The prompt goes through the sink, after everything printed before it !
+            output.write("".join(map(str, prompt)))
+            output.flush()
+            result = read()
+        if NUMERIC.search(str(result)):
             return float(result)
         else:
             return str(result)
 
+    def syntax(self):
+        if self.value is None:
+            return [leaf("CONSOLE_INPUT"), leaf("("), leaf(")")]
+        return [leaf("CONSOLE_INPUT"), leaf("("), Node("expression", self.value.syntax()), leaf(")")]
+
 
 class Main(BaseBox):
+    __slots__ = ('program',)
+
     def __init__(self, program):
         self.program = program
 
     def eval(self, node):
         program = Node("program")
         node.children.extend([program])
-        return self.program.eval(program)
+        self.program.state.start()
+        try:
+            result = self.program.eval(program)
+            self.program.state.finish()
+            return result
+        except RecursionError as e:
+            self.program.state.overflow(e)
+        finally:
+            self.program.state.flush()
+
+    def run(self):
+        # Execute the program without tracing it into a semantic tree !
+        self.program.state.start()
+        try:
+            result = self.program.run()
+            self.program.state.finish()
+            return result
+        except RecursionError as e:
+            self.program.state.overflow(e)
+        finally:
+            self.program.state.flush()
+
+    def syntax(self):
+        return [Node("program", self.program.syntax())]
 
 
 class ExpressParenthesis(BaseBox):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
     def eval(self, node):
         expression = Node("expression")
-        node.children.extend([Node("("), expression, Node(")")])
+        node.children.extend([leaf("("), expression, leaf(")")])
         return self.expression.eval(expression)
 
+    def run(self):
+        return self.expression.run()
+
+    def syntax(self):
+        return [leaf("("), Node("expression", self.expression.syntax()), leaf(")")]
+
 
 class StatementFull(BaseBox):
+    __slots__ = ('statement',)
+
     def __init__(self, statement):
         self.statement = statement
 
     def eval(self, node):
         statement = Node("statement")
-        node.children.extend([statement, Node(";")])
+        node.children.extend([statement, leaf(";")])
         return self.statement.eval(statement)
 
+    def run(self):
+        return self.statement.run()
+
+    def syntax(self):
+        return [Node("statement", self.statement.syntax()), leaf(";")]
+
 
 class Statement(BaseBox):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
@@ -607,3 +1072,10 @@ class Statement(BaseBox):
         expression = Node("expression")
         node.children.extend([expression])
         return self.expression.eval(expression)
+
+    def run(self):
+        return self.expression.run()
+
+    def syntax(self):
+        return [Node("expression", self.expression.syntax())]
+
@@ -1,14 +1,71 @@
-import json
+import os
+import sys
+from json.encoder import encode_basestring_ascii
+from rply.token import SourcePosition, Token
 
 
 class Node:
+    # No per-instance __dict__ and no separate {"name": ...} dict, text is built when serialized !
+    __slots__ = ('name', 'children')
+
     def __init__(self, arg_name, arg_children=None):
-        self.text = {"name": arg_name}
+        self.name = arg_name
         if arg_children is None:
             self.children = []
         else:
             self.children = arg_children
 
+    @property
+    def text(self):
+        return {"name": self.name}
+
+
+# Hash-consed nodes: one shared instance per distinct leaf or subtree. The table is capped by the memory it holds
+# and emptied when full, names bigger than INTERN_NAME_BYTES (e.g. long string literals) are never kept in it !
+INTERN_BYTES = 8 << 20
+INTERN_NAME_BYTES = 256
+ENTRY_BYTES = 200  # Rough size of the key, Node & dict slot of an entry, besides its name
+_interned = {}
+_interned_bytes = 0
+
+
+def shared(name, *children):
+    """Shared, immutable Node for `name` and `children`, which must be shared nodes too.
+
+    Children are a tuple, so extending a shared node fails instead of
+    changing every tree using it. Unhashable or big names (e.g. NumPy
+    arrays, long strings) and non shared children give a fresh Node with
+    the same JSON.
+    """
+    global _interned_bytes
+    try:
+        # type(name) keeps 1, 1.0 & True apart, repr() 0.0 & -0.0, the children are kept alive by the entry so
+        # their ids are stable, even once the table is emptied !
+        key = (type(name), repr(name) if type(name) is float else name) + tuple(id(child) for child in children)
+        node = _interned.get(key)
+    except TypeError:
+        return Node(name, list(children))
+    if node is None:
+        size = sys.getsizeof(name)
+        if size > INTERN_NAME_BYTES or not all(type(child.children) is tuple for child in children):
+            return Node(name, list(children))
+        size += ENTRY_BYTES + 8 * len(children)
+        if _interned_bytes + size > INTERN_BYTES:
+            _interned.clear()
+            _interned_bytes = 0
+        node = _interned[key] = Node(name, children)
+        _interned_bytes += size
+    return node
+
+
+def leaf(name):
+    # Shared Node without children, e.g. the punctuation & keywords of the trees, same key as shared(name) !
+    try:
+        node = _interned.get((type(name), repr(name) if type(name) is float else name))
+    except TypeError:
+        return Node(name)
+    return node if node is not None else shared(name)
+
 
 class ParsedTree:
     def __init__(self, root: Node):
@@ -28,14 +85,102 @@ class Wrapper:
 
 def serialize(obj):
     """JSON serializer for objects not serializable by default json code"""
+    if isinstance(obj, Node):
+        return {"text": obj.text, "children": obj.children}
+    if isinstance(obj, Token):
+        return {"name": obj.name, "value": obj.value, "source_pos": obj.source_pos}
+    if isinstance(obj, SourcePosition):
+        return {"idx": obj.idx, "lineno": obj.lineno, "colno": obj.colno}
     try:
         return obj.__dict__
     except AttributeError:
         return None
 
 
-def write(root: Node, filename: str):
-    data = json.dumps(ParsedTree(root), default=serialize)
-    with open('../treant-js-master/%s.json' % filename, 'w') as f:
+def _scalar(obj):
+    # Same spelling as json.dumps() for everything that isn't a container !
+    if isinstance(obj, str):
+        return encode_basestring_ascii(obj)
+    if obj is None:
+        return 'null'
+    if obj is True:
+        return 'true'
+    if obj is False:
+        return 'false'
+    if isinstance(obj, int):
+        return int.__repr__(obj)
+    if obj != obj:
+        return 'NaN'
+    if obj == float('inf'):
+        return 'Infinity'
+    if obj == -float('inf'):
+        return '-Infinity'
+    return float.__repr__(obj)
+
+
+def _key(key):
+    if isinstance(key, str):
+        return encode_basestring_ascii(key)
+    return '"%s"' % _scalar(key).strip('"')
+
+
+def iterencode(obj, compact=False):
+    """Yield the JSON text of obj chunk by chunk, walking it without recursion.
+
+    A container is dropped from the stack as soon as its last item is entered
+    and only its closing bracket is remembered, so the long right-nested
+    "program"/"block" chains cost one byte of stack per level.
+    """
+    item_separator, key_separator = (',', ':') if compact else (', ', ': ')
+    closers = bytearray()  # Closing brackets of the containers left through their last item !
+    # Each frame is [items, next_index, is_dict, closing_bracket, len(closers) when pushed] !
+    stack = [[(obj,), 0, False, '', 0]]
+    while stack:
+        frame = stack[-1]
+        items, index = frame[0], frame[1]
+        if index == len(items):
+            stack.pop()
+            mark = stack[-1][4] if stack else 0
+            yield frame[3] + closers[mark:frame[4]][::-1].decode()
+            del closers[mark:frame[4]]
+            continue
+        if index:
+            yield item_separator
+        item = items[index]
+        frame[1] = index + 1
+        if frame[2]:
+            key, item = item
+            yield _key(key) + key_separator
+        if not isinstance(item, (str, int, float, list, tuple, dict)) and item is not None:
+            item = serialize(item)
+        if isinstance(item, (dict, list, tuple)) and item:
+            if index + 1 == len(items) and len(stack) > 1:
+                # Entering the last item, so this frame is done except for its bracket !
+                stack.pop()
+                closers.append(ord(frame[3]))
+            if isinstance(item, dict):
+                yield '{'
+                stack.append([list(item.items()), 0, True, '}', len(closers)])
+            else:
+                yield '['
+                stack.append([item, 0, False, ']', len(closers)])
+        elif isinstance(item, dict):
+            yield '{}'
+        elif isinstance(item, (list, tuple)):
+            yield '[]'
+        else:
+            yield _scalar(item)
+
+
+def write(root: Node, filename: str, path='../treant-js-master/', compact=False, chunk_size=1 << 16):
+    # Stream the tree to the file, only about chunk_size characters are held in memory !
+    with open(os.path.join(path, '%s.json' % filename), 'w') as f:
         f.write("JSONParsedTree = ")
-        f.write(data)
\ No newline at end of file
+        chunk, size = [], 0
+        for text in iterencode(ParsedTree(root), compact):
+            chunk.append(text)
+            size += len(text)
+            if size >= chunk_size:
+                f.write(''.join(chunk))
+                chunk, size = [], 0
+        f.write(''.join(chunk))
@@ -0,0 +1,177 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from .lexer import Lexer
+from .parser import Parser, ParserState
+from .cache import ProgramCache
+from .optimizer import ConstantFolder
+from .typecheck import TypeInference
+from .bytecode import BytecodeCompiler, VirtualMachine
+from .codegen import PythonCodeGenerator, program_key
+from .output import MemorySink
+from .budget import Budget
+from .cli import isolated
+
+BACKENDS = ("ast", "bytecode", "python")
+PASSES = "fold,type"  # What prepare() does to the tree before compiling it, part of the compile() key !
+CHUNKSIZE = 64  # Input vectors per pool task, runs are short so a task carries many to keep the IPC small !
+
+# The program compiled once per worker process by setup(), every run resets its state !
+_state = None
+_run = None
+
+
+class InputFeed:
+    """Stand-in for input() reading the values of one run in order, EOFError once they're used up."""
+
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def __call__(self, prompt=""):
+        for value in self.values:
+            return str(value)
+        raise EOFError("EOF when reading a line")
+
+
+def prepare(state, main, backend="python", key=None):
+    # Fold, type & compile the parsed program once, returns the function running it (see compile() for `key`) !
+    main = TypeInference(state).infer(ConstantFolder(state).fold(main))
+    if backend == "python":
+        return PythonCodeGenerator(state).compile(main, key).run
+    elif backend == "bytecode":
+        bytecode = BytecodeCompiler(state).compile(main)
+        return lambda: VirtualMachine(bytecode).run()
+    return main.run
+
+
+def setup(source, backend="python", program_cache=None, limits=None):
+    # Initializer of the pool workers, whose stdin & warning filters are ours to change !
+    warnings.simplefilter("ignore")
+    sys.stdin = open(os.devnull)  # Only the input vectors feed the program !
+    build(source, backend, program_cache, limits)
+
+
+def build(source, backend="python", program_cache=None, limits=None):
+    global _state, _run
+    if program_cache is not None:
+        main, _state = ProgramCache(program_cache).compile(source)
+    else:
+        _state = ParserState()
+        main = Parser().build().parse(Lexer(fast=True).build().lex(source), state=_state)
+    if limits:
+        _state.budget = Budget(**limits)  # Before compiling, the backends only emit the checks for a budget !
+    _run = prepare(_state, main, backend, program_key(source, True, PASSES))
+
+
+def run_once(inputs):
+    """Run the worker's program on one input vector, in a reset state."""
+    state = _state
+    state.reset()
+    sink = state.output = MemorySink()
+    state.input = InputFeed(inputs)
+    result = {"inputs": list(inputs), "ok": False, "error": None, "output": ""}
+    try:
+        _run()
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = "%s: %s" % (type(e).__name__, e)
+    result["output"] = sink.getvalue()
+    if state.budget is not None:
+        result["usage"] = state.budget.usage()
+    result["variables"] = {name: value for name, value in state.variables.items() if is_plain(value)}
+    return result
+
+
+def run_chunk(chunk):
+    return [run_once(values) for values in chunk]
+
+
+def is_plain(value):
+    return type(value) in (bool, int, float, str)
+
+
+def run_batch(source, inputs, jobs=None, backend="python", program_cache=None, chunksize=None, limits=None):
+    """Compile `source` once per worker and run it on every input vector, results are yielded in order.
+
+    `limits` are the keyword arguments of the Budget every run gets, e.g. {"max_steps": 10 ** 6, "seconds": 1}.
+    """
+    if jobs == 1:
+        with isolated():
+            build(source, backend, program_cache, limits)
+        for values in inputs:
+            with isolated():
+                result = run_once(values)
+            yield result
+        return
+    jobs = jobs or os.cpu_count() or 1
+    chunksize = chunksize or CHUNKSIZE
+    inputs = iter(inputs)
+    with ProcessPoolExecutor(jobs, initializer=setup, initargs=(source, backend, program_cache, limits)) as pool:
+        # Feed the pool lazily, holding only a few chunks per worker, so the inputs may be a stream of any length !
+        pending = deque()
+        while True:
+            while len(pending) < jobs * 2:
+                chunk = [list(values) for values in islice(inputs, chunksize)]
+                if not chunk:
+                    break
+                pending.append(pool.submit(run_chunk, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+def read_inputs(path):
+    # One run per line: a CSV row for .csv files, otherwise a JSON list (or a single JSON value) !
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            for row in csv.reader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    values = json.loads(line)
+                    yield values if isinstance(values, list) else [values]
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Run one PPL program over many input vectors in parallel.")
+    arguments.add_argument("program", help="the .ppl source to run")
+    arguments.add_argument("inputs", help="input vectors, one run per line (JSON lists, or CSV rows for .csv)")
+    arguments.add_argument("--backend", choices=BACKENDS, default="python", help="how the program is run")
+    arguments.add_argument("--jobs", "-j", type=int, default=None, help="worker processes (default: every core)")
+    arguments.add_argument("--output", help="write the results as JSON lines here instead of stdout")
+    arguments.add_argument("--program-cache", metavar="DIR", help="load the parsed program from this cache")
+    arguments.add_argument("--max-steps", type=int, help="fail a run after executing this many statements")
+    arguments.add_argument("--timeout", type=float, help="fail a run after this many seconds")
+    arguments.add_argument("--max-depth", type=int, help="fail a run nesting more function calls than this")
+    arguments.add_argument("--max-output", type=int, help="fail a run printing more characters than this")
+    options = arguments.parse_args()
+    limits = {name: value for name, value in (("max_steps", options.max_steps), ("seconds", options.timeout),
+                                              ("max_depth", options.max_depth), ("max_output", options.max_output))
+              if value is not None}
+
+    with open(options.program) as f:
+        program = f.read()
+    runs, failed = 0, 0
+    start = time.perf_counter()
+    out = open(options.output, "w") if options.output else sys.stdout
+    try:
+        for result in run_batch(program, read_inputs(options.inputs), options.jobs, options.backend,
+                                options.program_cache, limits=limits):
+            runs += 1
+            failed += not result["ok"]
+            out.write(json.dumps(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    seconds = time.perf_counter() - start
+    print("%d runs, %d failed in %.3fs (%.1f runs/sec)" % (runs, failed, seconds, runs / seconds if seconds else 0.0),
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,368 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from .lexer import Lexer, TokenBuffer
+from .parser import Parser, ParserState
+from .JSONparsedTree import Node, write
+from .bytecode import BytecodeCompiler, VirtualMachine
+from .codegen import PythonCodeGenerator
+from .cache import ProgramCache
+from .output import BufferedSink, MemorySink
+
+
+def arithmetic_program(statements=200, calls=50):
+    # A function full of arithmetic expressions which is called over and over !
+    body = "".join("    (a + b * %d) / (c + %d) + a * a - b / 3;\n" % (i, i) for i in range(statements))
+    return "let a = 3; let b = 4.5; let c = 1;\nfunction work() {\n%s}\n%s" % (body, "work();\n" * calls)
+
+
+def variables_program(count=10000):
+    # Every let reads the previous variable, so each statement does one read & one write !
+    return "let v0 = 1;\n" + "".join("let v%d = v%d + 1;\n" % (i, i - 1) for i in range(1, count))
+
+
+def lexer_program(lines=20000):
+    # Mix of every token kind, one statement per line !
+    line = 'let v%d = (abs(-3) + 4.25 * __PI__) / 2 >= 1 and not false; print("value %d"); f%d();\n'
+    return "".join(line % (i, i, i) for i in range(lines))
+
+
+def statements_program(count):
+    # Straight line code mixing lets, prints and if/else !
+    lines = []
+    for i in range(count):
+        if i % 3 == 0:
+            lines.append("let s%d = %d * 2 + 1;" % (i, i))
+        elif i % 3 == 1:
+            lines.append("print(s%d - 1);" % (i - 1))
+        else:
+            lines.append("if (s%d > 10) { print(true); } else { print(false); }" % (i - 2))
+    return "\n".join(lines) + "\n"
+
+
+def expressions_program(depth):
+    # One deeply nested expression, every level adds parenthesis, an operator & a builtin !
+    expression = "1"
+    for i in range(depth):
+        expression = "(%s %s abs(%d))" % (expression, "+-*"[i % 3], i % 7 + 1)
+    return "let deep = %s;\nprint(deep);\n" % expression
+
+
+def functions_program(count):
+    # Many small functions, each one called once !
+    declarations = "".join("function f%d() {\n    print(%d + %d * 2);\n}\n" % (i, i, i) for i in range(count))
+    return declarations + "".join("f%d();\n" % i for i in range(count))
+
+
+# Scaled program generators of the suite and the sizes they're run at !
+WORKLOADS = {
+    "statements": (statements_program, (1000, 10000)),
+    "expressions": (expressions_program, (50, 200)),
+    "functions": (functions_program, (100, 1000)),
+    "variables": (variables_program, (1000, 10000)),
+}
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_vm(source):
+    lexer, parser = Lexer().build(), Parser().build()
+
+    def prepare():
+        state = ParserState()
+        return state, parser.parse(lexer.lex(source), state=state)
+
+    state, main = prepare()
+    tree = timed(lambda: main.eval(Node("main")))
+    state, main = prepare()
+    bytecode = BytecodeCompiler(state).compile(main)
+    vm = timed(lambda: VirtualMachine(bytecode).run())
+    state, main = prepare()
+    python = timed(PythonCodeGenerator(state).compile(main).run)
+    return {"Main.eval": tree, "VirtualMachine.run": vm, "PythonProgram.run": python,
+            "speed-up": tree / vm, "python speed-up": tree / python}
+
+
+def bench_lexer(source):
+    results = {}
+    for name, fast in (("rply", False), ("Scanner", True)):
+        lexer = Lexer(fast=fast).build()
+        count = []
+        seconds = timed(lambda: count.append(sum(1 for _ in lexer.lex(source))))
+        results[name] = {"tokens": count[0], "seconds": seconds, "tokens/sec": count[0] / seconds}
+    return results
+
+
+def bench_tokens(source):
+    # Memory of the lexed tokens kept as a list of rply Tokens vs a TokenBuffer !
+    lexer = Lexer(fast=True).build()
+    results = {}
+    for name, materialize in (("list", lambda: list(lexer.lex(source))),
+                              ("TokenBuffer", lambda: TokenBuffer(source, lexer.lex(source)))):
+        tracemalloc.start()
+        try:
+            tokens = materialize()
+            results[name] = {"tokens": len(tokens), "bytes": tracemalloc.get_traced_memory()[0]}
+        finally:
+            tracemalloc.stop()
+        del tokens
+    return results
+
+
+def bench_arrays(size=1000000):
+    # sin(xs) * rate + initial over a NumPy array, a few ufunc calls whatever the size !
+    import numpy
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    state = ParserState()
+    state.bind("xs", numpy.linspace(0, 100, size))
+    main = parser.parse(lexer.lex("let rate = 2; let initial = 60; let ys = sin(xs) * rate + initial;"), state=state)
+    seconds = timed(main.run)
+    return {"elements": size, "seconds": seconds, "elements/sec": size / seconds}
+
+
+def bench_program_cache(counts=(1000, 10000)):
+    # Cold compile (lex, parse & store) vs loading the parsed program back from the cache !
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for count in counts:
+            source = statements_program(count)
+            cold = timed(lambda: ProgramCache(path).compile(source))
+            cached = timed(lambda: ProgramCache(path).compile(source))
+            results[count] = {"cold": cold, "cached": cached, "speed-up": cold / cached}
+    return results
+
+
+def bench_output(count=100000):
+    # print() per statement vs the BufferedSink, into a line buffered file like a terminal or pipe under load !
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    source = "".join("print(%d);\n" % i for i in range(count))
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for name, sink in (("print", None), ("BufferedSink", BufferedSink)):
+            state = ParserState()
+            main = parser.parse(lexer.lex(source), state=state)
+            with open(os.path.join(path, name), "w", buffering=1) as f, contextlib.redirect_stdout(f):
+                state.output = sink() if sink is not None else None
+                results[name] = timed(main.run)
+    return results
+
+
+def bench_variables(counts=(10000, 20000, 40000)):
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    results = {}
+    for count in counts:
+        source = variables_program(count)
+        results[count] = {}
+        for mode in ("eval", "run"):
+            main = parser.parse(lexer.lex(source), state=ParserState())
+            results[count]["Main.%s" % mode] = timed(main.run if mode == "run" else lambda: main.eval(Node("main")))
+    return results
+
+
+def bench_statements(counts=(1000, 10000, 100000, 1000000)):
+    # Parse time should grow linearly with the number of statements !
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    results = {}
+    for count in counts:
+        tokens = list(lexer.lex(variables_program(count)))
+        seconds = timed(lambda: parser.parse(iter(tokens), state=ParserState()))
+        results[count] = {"seconds": seconds, "us/statement": seconds / count * 1e6}
+    return results
+
+
+def bench_write(counts=(1000, 10000, 100000)):
+    # Peak memory of write() on top of the tree itself, should stay flat as the tree grows !
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        for count in counts:
+            root = Node("main", parser.parse(lexer.lex(variables_program(count)), state=ParserState()).syntax())
+            seconds = timed(lambda: write(root, "SyntaxAnalyzer", path=path))
+            peak = peak_memory(lambda: write(root, "SyntaxAnalyzer", path=path))
+            size = os.path.getsize(os.path.join(path, "SyntaxAnalyzer.json"))
+            results[count] = {"seconds": seconds, "bytes_written": size, "peak_bytes": peak}
+    return results
+
+
+def bench_memory(count=20000):
+    # tracemalloc peak of each stage on a large script !
+    source = "let v0 = 1;\n" + "".join("let v%d = (v%d + 1) * 2 - sin(%d);\n" % (i, i - 1, i) for i in range(1, count))
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    tokens = list(lexer.lex(source))
+    results = {}
+    main = []
+    results["parse"] = peak_memory(lambda: main.append(parser.parse(iter(tokens), state=ParserState())))
+    results["syntax"] = peak_memory(lambda: Node("main", main[0].syntax()))
+    results["eval"] = peak_memory(lambda: main[0].eval(Node("main")))
+    return results
+
+
+def tree_size(root):
+    # (positions, bytes of a fresh Node per position, distinct nodes, bytes of the distinct nodes) of a tree !
+    positions, fresh, unique, shared = 0, 0, set(), 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        positions += 1
+        children = node.children if isinstance(node.children, (list, tuple)) else ()
+        fresh += sys.getsizeof(node) + sys.getsizeof(list(children))
+        if id(node) not in unique:
+            unique.add(id(node))
+            shared += sys.getsizeof(node) + (sys.getsizeof(node.children) if isinstance(node.children, list) else
+                                             sys.getsizeof(children) if children else 0)
+        stack.extend(children)
+    return positions, fresh, len(unique), shared
+
+
+def bench_interning(sources=None):
+    # Nodes & bytes the shared leaves and subtrees save, against one fresh Node (and list) per tree position !
+    sources = sources or {"arithmetic": arithmetic_program(), "variables": variables_program(20000),
+                          "functions": functions_program(2000)}
+    lexer, parser = Lexer(fast=True).build(), Parser().build()
+    results = {}
+    for name, source in sources.items():
+        state = ParserState()
+        state.output = MemorySink()
+        main = parser.parse(lexer.lex(source), state=state)
+        syntax, semantic = Node("main", main.syntax()), Node("main")
+        main.eval(semantic)
+        for tree, root in (("syntax", syntax), ("semantic", semantic)):
+            positions, fresh, unique, shared = tree_size(root)
+            results["%s.%s" % (name, tree)] = {"nodes": positions, "distinct_nodes": unique,
+                                               "nodes_saved": positions - unique, "bytes": fresh,
+                                               "bytes_saved": fresh - shared, "saved": 1 - shared / fresh}
+    return results
+
+
+def bench_trace(source):
+    lexer, parser = Lexer().build(), Parser().build()
+    results = {}
+    for mode in ("eval", "run"):
+        # Programs can't be run twice in one state (let is immutable), so parse once per measurement !
+        measured = []
+        for measure in (timed, peak_memory):
+            main = parser.parse(lexer.lex(source), state=ParserState())
+            measured.append(measure(main.run if mode == "run" else lambda: main.eval(Node("main"))))
+        results["Main.%s" % mode] = {"seconds": measured[0], "peak_bytes": measured[1]}
+    return results
+
+
+def measure(function, setup=lambda: ()):
+    # Time and memory are measured on separate runs, tracemalloc would skew the timing !
+    seconds = timed(lambda: function(*setup()))
+    arguments = setup()
+    return {"seconds": seconds, "peak_bytes": peak_memory(lambda: function(*arguments))}
+
+
+def bench_stages(source, fast=False):
+    """Time & memory profile every stage of the pipeline on one source."""
+    results = {"source_bytes": len(source)}
+    results["Lexer.build"] = measure(lambda: Lexer(fast=fast).build())
+    lexer = Lexer(fast=fast).build()
+    results["lex"] = measure(lambda: list(lexer.lex(source)))
+    tokens = list(lexer.lex(source))
+    results["tokens"] = len(tokens)
+    results["Parser.build"] = measure(lambda: Parser().build())
+    parser = Parser().build()
+    results["parse"] = measure(lambda: parser.parse(iter(tokens), state=ParserState()))
+
+    def parsed():
+        return parser.parse(iter(tokens), state=ParserState()), Node("main")
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["Main.eval"] = measure(lambda main, root: main.eval(root), parsed)
+        main, root = parsed()
+        main.eval(root)
+    with tempfile.TemporaryDirectory() as path:
+        results["write"] = measure(lambda: write(root, "SemanticAnalyzer", path=path))
+    return results
+
+
+def run_suite(workloads=WORKLOADS, fast=False):
+    results = {}
+    for name, (generate, sizes) in workloads.items():
+        for size in sizes:
+            results["%s/%d" % (name, size)] = bench_stages(generate(size), fast)
+    return results
+
+
+def revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous, current):
+    # Ratio current / previous of every stage's time, > 1.0 means slower !
+    ratios = {}
+    for workload, stages in current["results"].items():
+        before = previous["results"].get(workload, {})
+        for stage, measured in stages.items():
+            if isinstance(measured, dict) and stage in before and before[stage]["seconds"]:
+                ratios["%s %s" % (workload, stage)] = measured["seconds"] / before[stage]["seconds"]
+    return ratios
+
+
+if __name__ == '__main__':
+    warnings.simplefilter("ignore")
+    arguments = argparse.ArgumentParser(description="Benchmark every stage of the PPL compiler.")
+    arguments.add_argument("--output", default="benchmark.json", help="where to write the JSON results")
+    arguments.add_argument("--compare", help="previous JSON results to compare against")
+    arguments.add_argument("--fast-lexer", action="store_true", help="use the Scanner lexer backend")
+    arguments.add_argument("--all", action="store_true", help="also run the focused comparisons")
+    options = arguments.parse_args()
+
+    report = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "lexer": "Scanner" if options.fast_lexer else "rply",
+        "results": run_suite(fast=options.fast_lexer),
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=2)
+    for workload, stages in report["results"].items():
+        print(workload, {stage: round(measured["seconds"], 4) for stage, measured in stages.items()
+                         if isinstance(measured, dict)})
+    if options.compare:
+        with open(options.compare) as f:
+            for key, ratio in sorted(compare(json.load(f), report).items()):
+                print("%-40s %.2fx" % (key, ratio))
+
+    if options.all:
+        print("Bytecode VM & generated Python vs Main.eval:", bench_vm(arithmetic_program()))
+        print("Traced vs trace-free:", bench_trace(arithmetic_program()))
+        print("Lexer throughput:", bench_lexer(lexer_program()))
+        print("Token storage:", bench_tokens(lexer_program()))
+        print("Variable access:", bench_variables())
+        print("Vectorized arrays:", bench_arrays())
+        print("Output sinks:", bench_output())
+        print("Statement list scaling:", bench_statements())
+        print("Cold vs cached compile:", bench_program_cache())
+        print("Streaming tree dump:", bench_write())
+        print("Peak memory per stage:", bench_memory())
+        print("Shared tree nodes:", bench_interning())
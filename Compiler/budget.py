@@ -0,0 +1,117 @@
+import sys
+import time
+from .errors import *
+
+
+class Budget:
+    """Per-run limits of an untrusted program, enforced by every backend.
+
+    Attach it with `state.budget = Budget(...)` before compiling the program,
+    every run starts it again. Limits left to None aren't enforced:
+      - max_steps: statements executed, of the program, its blocks & calls,
+      - seconds: wall-clock time since the run started,
+      - max_depth: nested user-defined function calls,
+      - max_output: characters printed (input() prompts included),
+      - max_trace: statements traced into the semantic tree by eval().
+    Steps & trace count statements, not AST nodes: every statement of the
+    program, an if/else block or a function body counts one, whatever the
+    size of its expressions (`print(1 + 2 * 3);` is one step).
+    Statements are charged CHECK_EVERY at a time as they run, the steps &
+    the clock are checked about every CHECK_EVERY statements and once more
+    when the run ends. The Python backend charges a call of a function that
+    always runs the same statements (see bulk()) all at once when it can't
+    go over a limit, its usage counts them all when one raises an error. Going
+    over a limit raises BudgetExceededError with the usage so far, so does a
+    RecursionError (as the `recursion` resource).
+    """
+
+    __slots__ = ('max_steps', 'seconds', 'max_depth', 'max_output', 'max_trace',
+                 'steps', 'depth', 'deepest', 'output', 'trace', 'started', 'deadline', 'until')
+
+    CHECK_EVERY = 256
+
+    def __init__(self, max_steps=None, seconds=None, max_depth=None, max_output=None, max_trace=None):
+        self.max_steps = max_steps
+        self.seconds = seconds
+        self.max_depth = max_depth
+        self.max_output = max_output
+        self.max_trace = max_trace
+        self.start()
+
+    def start(self):
+        self.steps = 0
+        self.depth = 0
+        self.deepest = 0
+        self.output = 0
+        self.trace = 0
+        self.started = time.perf_counter()
+        self.deadline = None if self.seconds is None else self.started + self.seconds
+        self.until = 0  # Next step count at which check() runs !
+        self.check()
+
+    def run(self, statements):
+        # Program/Block.run() of a block due a check, its statements are charged a chunk at a time as they run !
+        result = None
+        for start in range(0, len(statements), self.CHECK_EVERY):
+            chunk = statements[start:start + self.CHECK_EVERY]
+            self.step(len(chunk))
+            for statement in chunk:
+                result = statement.run()
+        return result
+
+    def step(self, count, traced=False):
+        if traced:
+            self.trace += count
+            if self.max_trace is not None and self.trace > self.max_trace:
+                self.exceeded("trace", self.max_trace)
+        self.steps += count
+        if self.steps >= self.until:
+            self.check()
+
+    def check(self):
+        # Only called every CHECK_EVERY steps or so, so the clock is read rarely !
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exceeded("steps", self.max_steps)
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            self.exceeded("seconds", self.seconds)
+        self.until = self.steps + self.CHECK_EVERY
+        if self.max_steps is not None and self.until > self.max_steps:
+            self.until = self.max_steps
+
+    def enter(self, charged=0):
+        # Slow path of a call, the backends inline `depth += 1` & the charge of the callee's first `charged` steps
+        # and only call it once the call goes deeper than any before it or the steps are due a check. The depth is
+        # checked first, as if the callee's steps weren't charged yet !
+        self.steps -= charged
+        if self.depth > self.deepest:
+            self.deepest = self.depth
+            if self.max_depth is not None and self.depth > self.max_depth:
+                self.exceeded("depth", self.max_depth)
+        self.steps += charged
+        if self.steps >= self.until:
+            self.check()
+
+    def bulk(self, steps, height):
+        # Charges at once a call running `steps` statements in `height` nested calls whatever happens, when that's
+        # no more than its callees did before & doesn't reach a check, else the call is counted one by one !
+        if self.depth + height > self.deepest or self.steps + steps >= self.until:
+            return False
+        self.steps += steps
+        return True
+
+    def write(self, count):
+        # Checked before the text is written, so the output never goes over the limit !
+        self.output += count
+        if self.max_output is not None and self.output > self.max_output:
+            self.exceeded("output", self.max_output)
+
+    def overflow(self):
+        # Python's own recursion limit was hit before max_depth (if any) !
+        self.exceeded("recursion", sys.getrecursionlimit())
+
+    def usage(self):
+        return {"steps": self.steps, "seconds": round(time.perf_counter() - self.started, 6), "depth": self.deepest,
+                "output": self.output, "trace": self.trace}
+
+    def exceeded(self, resource, limit):
+        raise BudgetExceededError(resource, limit, self.usage())
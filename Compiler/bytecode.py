@@ -0,0 +1,305 @@
+import operator
+import sys
+from array import array
+from .AbstractSyntaxTree import *
+from .errors import *
+
+# Every instruction is an (opcode, argument) pair stored in one flat array !
+LOAD_CONST = 0
+LOAD_VAR = 1
+DECLARE_VAR = 2
+STORE_VAR = 3
+BINARY = 4
+APPLY0 = 5
+APPLY1 = 6
+APPLY2 = 7
+JUMP = 8
+JUMP_IF_FALSE = 9
+JUMP_IF_FALSE_OR_POP = 10
+JUMP_IF_TRUE_OR_POP = 11
+CALL = 12
+POP = 13
+RETURN = 14
+BUILD_ARRAY = 15
+STEP = 16  # Only emitted when the state has a Budget, before every Budget.CHECK_EVERY statements but a function's first !
+
+# Binary operators, indexed by the BINARY argument !
+BINARY_OPS = {
+    Sum: operator.add,
+    Sub: operator.sub,
+    Mul: operator.mul,
+    Div: operator.truediv,
+    Equal: operator.eq,
+    NotEqual: operator.ne,
+    GreaterThan: operator.gt,
+    LessThan: operator.lt,
+    GreaterThanEqual: operator.ge,
+    LessThanEqual: operator.le,
+}
+
+
+class Bytecode:
+    def __init__(self, state):
+        self.state = state
+        self.code = array('l')
+        self.consts = []
+        self.names = []
+        self.name_index = {}
+        self.nodes = []  # AST nodes whose apply() does the work of APPLY0/1/2 !
+        self.binary_ops = list(BINARY_OPS.values())
+        self.entries = {}  # Function name -> code offset
+        self.costs = {}  # Function name -> statements of its first chunk, charged by CALL instead of a STEP
+
+    def emit(self, opcode, arg=0):
+        self.code.append(opcode)
+        self.code.append(arg)
+        return len(self.code) - 2
+
+    def patch(self, at):
+        # Point the jump at `at` to the next instruction to be emitted !
+        self.code[at + 1] = len(self.code)
+
+    def const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def name(self, name):
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def node(self, node):
+        self.nodes.append(node)
+        return len(self.nodes) - 1
+
+
+class BytecodeCompiler:
+    """Compile a Main/Program/Block AST into Bytecode for the VirtualMachine."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def compile(self, main):
+        bytecode = Bytecode(self.state)
+        self.bytecode = bytecode
+        self.statements(main.program.get_statements())
+        bytecode.emit(RETURN)
+        # Every function was registered in the state while parsing, so lay them out after main !
+        for name, function in self.state.functions.items():
+            bytecode.entries[name] = len(bytecode.code)
+            bytecode.costs[name] = self.statements(function.block.get_statements(), entry=True)
+            bytecode.emit(RETURN)
+        return bytecode
+
+    def statements(self, statements, entry=False):
+        # Like Program.eval()/Block.eval(), only the last statement's value is kept, returns the steps left to CALL !
+        budget = self.state.budget
+        for i, statement in enumerate(statements):
+            if budget is not None and not i % budget.CHECK_EVERY and not (entry and i == 0):
+                self.bytecode.emit(STEP, min(budget.CHECK_EVERY, len(statements) - i))
+            self.visit(statement)
+            if i != len(statements) - 1:
+                self.bytecode.emit(POP)
+        return min(budget.CHECK_EVERY, len(statements)) if budget is not None and entry else 0
+
+    def visit(self, node):
+        bytecode = self.bytecode
+        if isinstance(node, (StatementFull, Statement, ExpressParenthesis)):
+            self.visit(node.statement if isinstance(node, StatementFull) else node.expression)
+        elif isinstance(node, Constant):
+            bytecode.emit(LOAD_CONST, bytecode.const(node.value))
+        elif isinstance(node, Variable):
+            bytecode.emit(LOAD_VAR, node.slot)
+        elif isinstance(node, Assignment):
+            if not isinstance(node.left, Variable):
+                raise LogicError("Cannot assign to <%s>" % node)
+            bytecode.emit(DECLARE_VAR, node.left.slot)
+            self.visit(node.right)
+            bytecode.emit(STORE_VAR, node.left.slot)
+        elif isinstance(node, And) or isinstance(node, Or):
+            self.visit(node.left)
+            jump = bytecode.emit(JUMP_IF_FALSE_OR_POP if isinstance(node, And) else JUMP_IF_TRUE_OR_POP)
+            self.visit(node.right)
+            bytecode.patch(jump)
+        elif type(node) in BINARY_OPS:
+            self.visit(node.left)
+            self.visit(node.right)
+            bytecode.emit(BINARY, bytecode.binary_ops.index(BINARY_OPS[type(node)]))
+        elif isinstance(node, Pow):
+            self.visit(node.expression)
+            self.visit(node.expression2)
+            bytecode.emit(APPLY2, bytecode.node(node))
+        elif isinstance(node, (BaseFunction, Not)):
+            self.visit(node.expression)
+            bytecode.emit(APPLY1, bytecode.node(node))
+        elif isinstance(node, (Print, Input)):
+            if node.value is None:
+                bytecode.emit(APPLY0, bytecode.node(node))
+            else:
+                self.visit(node.value)
+                bytecode.emit(APPLY1, bytecode.node(node))
+        elif isinstance(node, Array):
+            for element in node.elements:
+                self.visit(element)
+            bytecode.emit(BUILD_ARRAY, bytecode.node(node))
+        elif isinstance(node, If):
+            self.visit(node.condition)
+            jump_else = bytecode.emit(JUMP_IF_FALSE)
+            self.statements(node.body.get_statements())
+            jump_end = bytecode.emit(JUMP)
+            bytecode.patch(jump_else)
+            if node.else_body is not None:
+                self.statements(node.else_body.get_statements())
+            else:
+                bytecode.emit(LOAD_CONST, bytecode.const(None))
+            bytecode.patch(jump_end)
+        elif isinstance(node, CallFunction):
+            bytecode.emit(CALL, bytecode.name(node.name))
+        elif isinstance(node, FunctionDeclaration):
+            # Already registered while parsing, the declaration evaluates to itself !
+            bytecode.emit(LOAD_CONST, bytecode.const(node))
+        else:
+            raise LogicError("Cannot compile <%s>" % node)
+
+
+class VirtualMachine:
+    """Stack based dispatch loop running the Bytecode of a program.
+
+    Calls don't use the Python stack, so nesting more than max_frames of them
+    (Python's recursion limit by default) raises RecursionError like the AST.
+    """
+
+    def __init__(self, bytecode, max_frames=None):
+        self.bytecode = bytecode
+        self.max_frames = sys.getrecursionlimit() if max_frames is None else max_frames
+
+    def run(self):
+        self.bytecode.state.start()
+        try:
+            result = self.execute()
+            self.bytecode.state.finish()
+            return result
+        except RecursionError as e:
+            self.bytecode.state.overflow(e)
+        finally:
+            self.bytecode.state.flush()
+
+    def execute(self):
+        bytecode = self.bytecode
+        code, consts, names, nodes = bytecode.code, bytecode.consts, bytecode.names, bytecode.nodes
+        binary_ops, entries = bytecode.binary_ops, bytecode.entries
+        values, slot_names = bytecode.state.values, bytecode.state.names
+        budget, memo, functions = bytecode.state.budget, bytecode.state.memo, bytecode.state.functions
+        max_frames = self.max_frames
+        # The call depth is len(frames) and the steps are counted down in `fuel`, the steps left until the budget
+        # is due a check: calls at least `limit` deep or running out of fuel take the slow path updating the budget !
+        limit, fuel = (max_frames, sys.maxsize) if budget is None else (0, budget.until - budget.steps)
+        costs = [bytecode.costs.get(name, 0) for name in names]  # Of every name index, see Bytecode.costs
+        stack = []
+        frames = []  # Return addresses of the active calls
+        keys = []  # Memo key of every active call, None when its result isn't cached
+        pc = 0
+        try:
+            while True:
+                opcode = code[pc]
+                arg = code[pc + 1]
+                pc += 2
+                if opcode == LOAD_CONST:
+                    stack.append(consts[arg])
+                elif opcode == LOAD_VAR:
+                    value = values[arg]
+                    if value is None:
+                        raise LogicError("Variable <%s> is not yet defined" % slot_names[arg])
+                    stack.append(value)
+                elif opcode == BINARY:
+                    right = stack.pop()
+                    stack[-1] = binary_ops[arg](stack[-1], right)
+                elif opcode == POP:
+                    stack.pop()
+                elif opcode == APPLY1:
+                    stack[-1] = nodes[arg].apply(stack[-1])
+                elif opcode == APPLY2:
+                    right = stack.pop()
+                    stack[-1] = nodes[arg].apply(stack[-1], right)
+                elif opcode == APPLY0:
+                    stack.append(nodes[arg].apply())
+                elif opcode == JUMP_IF_FALSE:
+                    if not stack.pop():
+                        pc = arg
+                elif opcode == JUMP:
+                    pc = arg
+                elif opcode == JUMP_IF_FALSE_OR_POP:
+                    if stack[-1]:
+                        stack.pop()
+                    else:
+                        pc = arg
+                elif opcode == JUMP_IF_TRUE_OR_POP:
+                    if stack[-1]:
+                        pc = arg
+                    else:
+                        stack.pop()
+                elif opcode == DECLARE_VAR:
+                    if values[arg] is not None:
+                        raise ImmutableError(slot_names[arg])
+                elif opcode == STORE_VAR:
+                    values[arg] = stack[-1]  # Assignment.eval() returns the assigned value too !
+                elif opcode == CALL:
+                    if names[arg] not in entries:
+                        raise KeyError(names[arg])
+                    key = None
+                    if memo is not None:
+                        key = memo.key(functions[names[arg]], "run")
+                        entry = None if key is None else memo.lookup(key)
+                        if entry is not None:
+                            if budget is not None and len(frames) >= budget.deepest:
+                                # A cached call nests once too, like on the AST !
+                                budget.steps, budget.depth = budget.until - fuel, len(frames) + 1
+                                budget.enter()
+                                fuel = budget.until - budget.steps
+                            stack.append(entry[0])
+                            continue
+                    fuel -= costs[arg]  # The steps of the body's first chunk, instead of a STEP !
+                    if len(frames) >= limit or fuel <= 0:
+                        fuel += costs[arg]  # Charged again once the call may start, like on the AST !
+                        if budget is not None:
+                            budget.steps, budget.depth = budget.until - fuel, len(frames) + 1
+                            budget.enter()
+                            limit, fuel = min(max_frames, budget.deepest), budget.until - budget.steps
+                        if len(frames) >= max_frames:
+                            raise RecursionError("maximum recursion depth exceeded")
+                        fuel -= costs[arg]
+                        if fuel <= 0:
+                            budget.steps = budget.until - fuel
+                            budget.check()
+                            fuel = budget.until - budget.steps
+                    frames.append(pc)
+                    keys.append(key)
+                    pc = entries[names[arg]]
+                elif opcode == BUILD_ARRAY:
+                    count = len(nodes[arg].elements)
+                    value = nodes[arg].apply(*stack[-count:])
+                    del stack[-count:]
+                    stack.append(value)
+                elif opcode == RETURN:
+                    if not frames:
+                        return stack.pop() if stack else None
+                    key = keys.pop()
+                    if key is not None:
+                        memo.store(key, (stack[-1],))
+                    pc = frames.pop()
+                elif opcode == STEP:
+                    fuel -= arg
+                    if fuel <= 0:
+                        budget.steps = budget.until - fuel
+                        budget.check()
+                        fuel = budget.until - budget.steps
+                else:
+                    raise LogicError("Unknown opcode <%s>" % opcode)
+        except BudgetExceededError as e:
+            # Budget.write() (print & input) raises before the steps counted in `fuel` were handed over !
+            e.usage["steps"] = budget.until - fuel
+            raise
+        finally:
+            if budget is not None:
+                budget.steps = budget.until - fuel
@@ -0,0 +1,160 @@
+import gc
+import hashlib
+import hmac
+import mmap
+import os
+import pickle
+import sys
+import tempfile
+from appdirs import AppDirs
+from .lexer import Lexer
+from .parser import Parser, ParserState
+
+
+def compiler_version():
+    # Hash of the modules which shape the AST, so any change to them invalidates every cached program !
+    digest = hashlib.sha256(("%d.%d" % sys.version_info[:2]).encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for module in ("AbstractSyntaxTree.py", "parser.py", "lexer.py", "errors.py", "JSONparsedTree.py"):
+        with open(os.path.join(directory, module), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+VERSION = compiler_version()
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def user_secret(path=None):
+    # Random key of this user, only readable by them, which signs the entries they store (None if it can't be had) !
+    if path is None:
+        path = os.path.join(AppDirs("ppl").user_data_dir, "cache.key")
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return None
+    secret = os.urandom(32)
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return user_secret(path)  # Another process made it first !
+    except OSError:
+        return None
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+class ProgramCache:
+    """Directory of parsed programs, so an unchanged source skips both the lexer and the parser.
+
+    Each entry is the pickle of the (Main, ParserState) pair right after
+    parsing, named after the hash of the source, the compiler version and
+    the lexer used, as the Scanner and rply lexers don't always agree.
+    Entries are loaded through mmap, hits refresh the file's mtime and the
+    least recently used entries are evicted once the directory grows over
+    max_bytes.
+
+    Unpickling can run any code, so every entry starts with the HMAC-SHA256
+    of its pickle under `secret`, by default a random key of the user kept
+    in their data directory (see user_secret()). Entries written by anyone
+    else are never unpickled, they're parsed again and replaced. Without a
+    secret nothing is cached.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=64 << 20, fast=True, secret=None):
+        if cache_dir is None:
+            cache_dir = os.path.join(AppDirs("ppl").user_cache_dir, "programs")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.fast = fast
+        self.secret = secret if secret is not None else user_secret()
+        self.lexer = None
+        self.parser = None
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, source):
+        key = hashlib.sha256(source.encode()).hexdigest()
+        return os.path.join(self.cache_dir, "%s-%s-%s.ast" % (key, VERSION, "scanner" if self.fast else "rply"))
+
+    def compile(self, source):
+        # Same result as parser.parse(lexer.lex(source), state=ParserState()), from the cache when possible !
+        program = self.load(source)
+        if program is not None:
+            self.hits += 1
+            return program
+        self.misses += 1
+        if self.parser is None:
+            # Built only on the first miss, a fully cached run never builds the lexer or the LALR tables !
+            self.lexer, self.parser = Lexer(fast=self.fast).build(), Parser().build()
+        state = ParserState()
+        main = self.parser.parse(self.lexer.lex(source), state=state)
+        self.store(source, main, state)
+        return main, state
+
+    def sign(self, data):
+        return hmac.new(self.secret, data, hashlib.sha256).digest()
+
+    def load(self, source):
+        if self.secret is None:
+            return None
+        path = self.path(source)
+        # Unpickling only allocates, the collector would rescan the growing tree over and over !
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+                    memoryview(data) as view:
+                if not hmac.compare_digest(view[:DIGEST_SIZE], self.sign(view[DIGEST_SIZE:])):
+                    return None  # Not stored by us (or corrupted), so never unpickled !
+                main, state = pickle.loads(view[DIGEST_SIZE:])
+            os.utime(path)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None  # Missing, empty or corrupted entry, so parse it again !
+        finally:
+            if collecting:
+                gc.enable()
+        return main, state
+
+    def store(self, source, main, state):
+        if self.secret is None:
+            return
+        try:
+            data = pickle.dumps((main, state), pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            return  # Too deeply nested to pickle, the program is just parsed every time !
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as f:
+                f.write(self.sign(data))
+                f.write(data)
+            os.replace(f.name, self.path(source))
+            self.evict()
+        except OSError:
+            pass  # A read-only cache only costs us the parse next time !
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".ast"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".ast"):
+                os.remove(entry.path)
@@ -0,0 +1,180 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from .lexer import Lexer
+from .parser import Parser, ParserState
+from .JSONparsedTree import Node, write
+from .optimizer import ConstantFolder
+from .typecheck import TypeInference
+from .bytecode import BytecodeCompiler, VirtualMachine
+from .codegen import PythonCodeGenerator, program_key
+from .cache import ProgramCache
+from .output import MemorySink
+
+MODES = ("check", "eval", "dump")
+# How eval mode runs a parsed (folded & typed) program !
+BACKENDS = {
+    "ast": lambda state, main, key: main.run(),
+    "bytecode": lambda state, main, key: VirtualMachine(BytecodeCompiler(state).compile(main)).run(),
+    "python": lambda state, main, key: PythonCodeGenerator(state).compile(main, key).run(),
+}
+
+# Built once per worker process by setup(), every file compiled by the worker reuses them !
+_lexer = None
+_parser = None
+_programs = None
+_fast = False
+
+
+def setup(fast=False, cache_dir=None, program_cache=None):
+    # Initializer of the pool workers, whose stdin & warning filters are ours to change !
+    warnings.simplefilter("ignore")
+    # Workers share the terminal, a program waiting on input() would hang the whole batch !
+    sys.stdin = open(os.devnull)
+    build(fast, cache_dir, program_cache)
+
+
+@contextlib.contextmanager
+def isolated():
+    # Same stdin & warning filters as setup() for work done in the caller's process (jobs=1), restored afterwards !
+    stdin = sys.stdin
+    with warnings.catch_warnings(), open(os.devnull) as devnull:
+        warnings.simplefilter("ignore")
+        sys.stdin = devnull
+        try:
+            yield
+        finally:
+            sys.stdin = stdin
+
+
+def build(fast=False, cache_dir=None, program_cache=None):
+    global _lexer, _parser, _programs, _fast
+    _lexer = Lexer(fast=fast).build()
+    _fast = fast
+    _parser = Parser(cache_dir=cache_dir).build()
+    if program_cache is not None:
+        _programs = ProgramCache(program_cache, fast=fast)
+
+
+def find_sources(paths):
+    # Expand directories into their .ppl files (recursively), files are kept as given !
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in sorted(os.walk(path)):
+                sources.extend(os.path.join(directory, name) for name in sorted(files) if name.endswith(".ppl"))
+        else:
+            sources.append(path)
+    return sources
+
+
+def dump_paths(sources, output):
+    # <root>/a/c.ppl -> <output>/a/c/, relative to the sources' common directory so dumps never collide !
+    if not sources:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(source)) for source in sources])
+    return [os.path.join(output, os.path.splitext(os.path.relpath(os.path.abspath(source), root))[0])
+            for source in sources]
+
+
+def compile_file(source, mode="eval", output=".", backend="ast"):
+    """Lex, parse and type check, evaluate or dump (into the `output` directory) one source file."""
+    result = {"file": source, "ok": False, "error": None, "output": "", "seconds": 0.0}
+    start = time.perf_counter()
+    stdout = io.StringIO()
+    sink = None
+    try:
+        with open(source) as f:
+            text = f.read()
+        with contextlib.redirect_stdout(stdout):
+            if _programs is not None:
+                main, state = _programs.compile(text)
+            else:
+                state = ParserState()
+                main = _parser.parse(_lexer.lex(text), state=state)
+            sink = state.output = MemorySink()
+            if mode == "check":
+                TypeInference(state).infer(main)
+            elif mode == "eval":
+                main = TypeInference(state).infer(ConstantFolder(state).fold(main))
+                BACKENDS[backend](state, main, program_key(text, _fast, "fold,type"))
+            elif mode == "dump":
+                os.makedirs(output, exist_ok=True)
+                write(Node("main", main.syntax()), "SyntaxAnalyzer", path=output)
+                semantic = Node("main")
+                main.eval(semantic)
+                write(semantic, "SemanticAnalyzer", path=output)
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = describe(e)
+    result["output"] = stdout.getvalue() + (sink.getvalue() if sink is not None else "")
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def describe(error):
+    # rply's LexingError/ParsingError carry the position instead of a message !
+    position = getattr(error, "source_pos", None)
+    message = str(error) or getattr(error, "message", "")
+    if position is not None:
+        return "%s at line %d, column %d: %s" % (type(error).__name__, position.lineno, position.colno, message)
+    return "%s: %s" % (type(error).__name__, message)
+
+
+def compile_all(sources, mode="eval", output=".", jobs=None, fast=False, cache_dir=None, backend="ast",
+                program_cache=None):
+    """Compile every source on a pool of `jobs` processes, results are yielded in the order of `sources`."""
+    outputs = dump_paths(sources, output)
+    if jobs == 1:
+        with isolated():
+            build(fast, cache_dir, program_cache)
+        for source, path in zip(sources, outputs):
+            with isolated():
+                result = compile_file(source, mode, path, backend)
+            yield result
+        return
+    jobs = jobs or os.cpu_count() or 1
+    # Batch small files together so the pool's IPC doesn't dominate !
+    chunksize = max(1, len(sources) // (jobs * 4))
+    with ProcessPoolExecutor(jobs, initializer=setup, initargs=(fast, cache_dir, program_cache)) as pool:
+        yield from pool.map(compile_file, sources, [mode] * len(sources), outputs, [backend] * len(sources),
+                            chunksize=chunksize)
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Compile many PPL source files in parallel.")
+    arguments.add_argument("paths", nargs="+", help=".ppl files or directories containing them")
+    arguments.add_argument("--mode", choices=MODES, default="eval",
+                           help="check: lex, parse & type check only, eval: run the programs, "
+                                "dump: write the JSON trees")
+    arguments.add_argument("--backend", choices=sorted(BACKENDS), default="ast",
+                           help="how eval runs the programs: the AST, the bytecode VM or generated Python code")
+    arguments.add_argument("--jobs", "-j", type=int, default=None, help="worker processes (default: every core)")
+    arguments.add_argument("--output", default=".", help="where dump writes the trees of each file")
+    arguments.add_argument("--fast-lexer", action="store_true", help="use the Scanner lexer backend")
+    arguments.add_argument("--program-cache", metavar="DIR",
+                           help="keep the parsed programs in DIR, unchanged sources skip lexing & parsing")
+    arguments.add_argument("--quiet", "-q", action="store_true", help="don't print the programs' output")
+    options = arguments.parse_args()
+
+    sources = find_sources(options.paths)
+    failed = 0
+    start = time.perf_counter()
+    for result in compile_all(sources, options.mode, options.output, options.jobs, options.fast_lexer,
+                              backend=options.backend, program_cache=options.program_cache):
+        if result["ok"]:
+            print("ok     %s (%.3fs)" % (result["file"], result["seconds"]))
+        else:
+            failed += 1
+            print("FAILED %s: %s" % (result["file"], result["error"]))
+        if result["output"] and not options.quiet:
+            print(result["output"], end="" if result["output"].endswith("\n") else "\n")
+    seconds = time.perf_counter() - start
+    print("%d files, %d failed in %.3fs (%.1f files/sec)" % (len(sources), failed, seconds,
+                                                            len(sources) / seconds if seconds else 0.0))
+    sys.exit(1 if failed else 0)
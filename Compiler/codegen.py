@@ -0,0 +1,296 @@
+import functools
+import hashlib
+import math
+from collections import OrderedDict
+from .AbstractSyntaxTree import *
+from .errors import *
+
+# Python operator of every BinaryOp, And & Or short-circuit exactly like their run() !
+OPERATORS = {
+    Sum: "+", Sub: "-", Mul: "*", Div: "/",
+    Equal: "==", NotEqual: "!=", GreaterThan: ">", LessThan: "<", GreaterThanEqual: ">=", LessThanEqual: "<=",
+    And: "and", Or: "or",
+}
+
+# (source, code object) of the programs already compiled by this process, keyed by the hash of the program they were
+# generated from when the caller names it, else by the hash of the generated source !
+CODE_CACHE_SIZE = 128
+_code = OrderedDict()
+
+
+def cached_compile(source, key=None):
+    key = key or hashlib.sha256(source.encode()).hexdigest()
+    entry = _code.get(key)
+    if entry is None:
+        entry = _code[key] = (source, compile(source, "<ppl %s>" % key[:12], "exec"))
+        if len(_code) > CODE_CACHE_SIZE:
+            _code.popitem(last=False)
+    else:
+        _code.move_to_end(key)
+    return entry
+
+
+def program_key(source, fast, passes=""):
+    # compile() key of a program parsed from `source` by the Scanner (fast) or rply lexer, which don't always agree,
+    # then rewritten by `passes` (e.g. "fold,type" once ConstantFolder & TypeInference ran), the key names the tree !
+    return "%s\0%s\0%s" % ("scanner" if fast else "rply", passes, source)
+
+
+def node_classes(base=BaseBox):
+    for cls in base.__subclasses__():
+        yield cls
+        yield from node_classes(cls)
+
+
+class Prototypes(dict):
+    # _n["Sin"] is a node of that class whose apply() the generated code calls, made for the state on first use !
+    def __init__(self, state):
+        super().__init__()
+        self.state = state
+
+    def __missing__(self, name):
+        node = self[name] = object.__new__({cls.__name__: cls for cls in node_classes()}[name])
+        node.state = self.state  # apply() only needs the state (print & input) and class attributes !
+        return node
+
+
+def undefined(name):
+    raise LogicError("Variable <%s> is not yet defined" % name)
+
+
+def unbulked(steps, height):
+    return False
+
+
+class PythonProgram:
+    """Generated Python source of a program, its code object and the objects it refers to."""
+
+    def __init__(self, source, code, namespace, main=None, state=None):
+        self.source = source
+        self.code = code
+        self.namespace = namespace
+        self.main = main  # AST to run instead when CPython can't compile the source (too deeply nested) !
+        self.state = state
+        self.functions = dict(namespace["_f"])  # Generated function of every name, as the calls find them in _f
+
+    def run(self):
+        if self.code is None:
+            return self.main.run()
+        memo = self.state.memo
+        # The calls look functions up in _f, through the memo when there's one (it may be set after compiling) !
+        self.namespace["_f"] = self.functions if memo is None else {
+            name: functools.partial(memo.call, self.state.functions[name], function)
+            for name, function in self.functions.items()}
+        if self.state.budget is not None:
+            # The memo's hits don't run the statements Budget.bulk() would charge, so calls stay counted one by one !
+            self.namespace["_bulk"] = self.state.budget.bulk if memo is None else unbulked
+        self.state.start()
+        try:
+            result = self.namespace["_main"]()
+            self.state.finish()
+            return result
+        except RecursionError as e:
+            self.state.overflow(e)
+        finally:
+            self.state.flush()
+
+
+class PythonCodeGenerator:
+    """Translate a Main AST into Python source and compile() it into a code object.
+
+    Every function becomes a Python function, variables are indexes into
+    ParserState.values, builtins, print & input call the apply() of a node
+    of the same class, so the semantics (errors, rounding) are exactly those
+    of Main.run(). The generated code only refers to the state, never to the
+    AST, so compile(main, key) can reuse the code generated for the same key.
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def compile(self, main, key=None):
+        # `key` names the tree main is (see program_key()), the code is cached for it & the state !
+        namespace = {"_v": self.state.values, "_n": Prototypes(self.state), "_d": self.state.functions, "_f": {},
+                     "_undefined": undefined, "ImmutableError": ImmutableError, "_b": self.state.budget}
+        if key is not None:
+            budget = self.state.budget
+            key = "\0".join((key, repr(self.state.names), repr(list(self.state.functions)),
+                             repr(budget and budget.CHECK_EVERY)))
+            key = hashlib.sha256(key.encode()).hexdigest()
+        entry = _code.get(key) if key is not None else None
+        if entry is not None:
+            _code.move_to_end(key)
+        else:
+            self.lines = []
+            try:
+                entry = cached_compile(self.generate(main), key)
+            except (SyntaxError, RecursionError, MemoryError):
+                # Too deeply nested for CPython's compiler, the program still runs on the AST !
+                return PythonProgram(None, None, namespace, main, self.state)
+        source, code = entry
+        exec(code, namespace)
+        return PythonProgram(source, code, namespace, main, self.state)
+
+    def generate(self, main):
+        budget = self.state.budget
+        self.sizes = {} if budget is None else self.static_sizes()
+        self.indexes = {name: i for i, name in enumerate(self.state.functions)}
+        self.fast = False
+        self.function("_main", main.program.get_statements())
+        names = {}
+        for i, (name, function) in enumerate(self.state.functions.items()):
+            names[name] = "_function%d" % i
+            self.function(names[name], function.block.get_statements(), budget is not None)
+        # Unaccounted copy of every static function, its calls charged at once by Budget.bulk() !
+        self.fast = True
+        for name in self.sizes:
+            self.function("_fast%d" % self.indexes[name], self.state.functions[name].block.get_statements())
+        self.fast = False
+        self.lines.append("_f.update({%s})" % ", ".join("%r: %s" % item for item in names.items()))
+        return "\n".join(self.lines) + "\n"
+
+    def static_sizes(self):
+        # (statements, nested calls) run by every call of the static functions, those always running the same
+        # statements: no if, and/or, print or input, only calls to static functions, at most CHECK_EVERY statements !
+        sizes = {}
+
+        def size(name):
+            if name not in sizes:
+                sizes[name] = None  # Until known, so recursive calls aren't static
+                function = self.state.functions.get(name)
+                if function is None:
+                    return None
+                statements = function.block.get_statements()
+                calls = [self.calls(statement) for statement in statements]
+                if None in calls:
+                    return None
+                callees = [size(callee) for callee in sum(calls, [])]
+                if None in callees:
+                    return None
+                steps = len(statements) + sum(steps for steps, _ in callees)
+                if steps <= self.state.budget.CHECK_EVERY:
+                    sizes[name] = (steps, 1 + max((height for _, height in callees), default=0))
+            return sizes[name]
+
+        for name in self.state.functions:
+            size(name)
+        return {name: sizes[name] for name in self.state.functions if sizes[name] is not None}
+
+    def calls(self, node):
+        # Names of the functions a statement calls, None when it may not run the same statements every time !
+        if isinstance(node, StatementFull):
+            return self.calls(node.statement)
+        elif isinstance(node, Statement):
+            return self.calls(node.expression)
+        elif isinstance(node, Assignment):
+            return self.calls(node.right) if isinstance(node.left, Variable) else None
+        elif isinstance(node, ExpressParenthesis):
+            return self.calls(node.expression)
+        elif isinstance(node, (Constant, Variable, FunctionDeclaration)):
+            return []
+        elif type(node) in OPERATORS and type(node) not in (And, Or):
+            left, right = self.calls(node.left), self.calls(node.right)
+            return None if left is None or right is None else left + right
+        elif isinstance(node, Pow):
+            left, right = self.calls(node.expression), self.calls(node.expression2)
+            return None if left is None or right is None else left + right
+        elif isinstance(node, (BaseFunction, Not)):
+            return self.calls(node.expression)
+        elif isinstance(node, Array):
+            calls = [self.calls(e) for e in node.elements]
+            return None if None in calls else sum(calls, [])
+        elif isinstance(node, CallFunction):
+            return [node.name]
+        return None
+
+    def function(self, name, statements, budgeted=False):
+        self.lines.append("def %s():" % name)
+        if budgeted:
+            # Budget.enter() inlined with the steps of the first chunk, only called when it's due. A failing call
+            # ends the run (start() resets the depth), so the leave needs no finally !
+            charged = min(self.state.budget.CHECK_EVERY, len(statements))
+            self.lines.append("    _b.depth += 1")
+            self.lines.append("    _b.steps += %d" % charged)
+            self.lines.append("    if _b.depth > _b.deepest or _b.steps >= _b.until:")
+            self.lines.append("        _b.enter(%d)" % charged)
+        self.statements(statements, 1, budgeted)
+        if budgeted:
+            self.lines.append("    _b.depth -= 1")
+        self.lines.append("    return _r")
+
+    def statements(self, statements, depth, charged=False):
+        # Like Program.run()/Block.run(), _r holds the value of the last statement. With `charged` the function's
+        # entry already charged the first chunk !
+        budget = self.state.budget
+        for i, statement in enumerate(statements):
+            if budget is not None and not self.fast and not i % budget.CHECK_EVERY and not (charged and i == 0):
+                # Budget.step() inlined !
+                indent = "    " * depth
+                self.lines.append("%s_b.steps += %d" % (indent, min(budget.CHECK_EVERY, len(statements) - i)))
+                self.lines.append("%sif _b.steps >= _b.until:" % indent)
+                self.lines.append("%s    _b.check()" % indent)
+            self.statement(statement, depth)
+
+    def statement(self, node, depth):
+        indent = "    " * depth
+        if isinstance(node, StatementFull):
+            self.statement(node.statement, depth)
+        elif isinstance(node, Assignment):
+            if not isinstance(node.left, Variable):
+                raise LogicError("Cannot assign to <%s>" % node)
+            slot = node.left.slot
+            self.lines.append("%sif _v[%d] is not None:" % (indent, slot))
+            self.lines.append("%s    raise ImmutableError(%r)" % (indent, node.left.get_name()))
+            self.lines.append("%s_v[%d] = _r = %s" % (indent, slot, self.expression(node.right)))
+        elif isinstance(node, If):
+            self.lines.append("%sif %s:" % (indent, self.expression(node.condition)))
+            self.statements(node.body.get_statements(), depth + 1)
+            self.lines.append("%selse:" % indent)
+            if node.else_body is not None:
+                self.statements(node.else_body.get_statements(), depth + 1)
+            else:
+                self.lines.append("%s    _r = None" % indent)
+        elif isinstance(node, Statement):
+            self.lines.append("%s_r = %s" % (indent, self.expression(node.expression)))
+        else:
+            self.lines.append("%s_r = %s" % (indent, self.expression(node)))
+
+    def expression(self, node):
+        if isinstance(node, ExpressParenthesis):
+            return self.expression(node.expression)
+        elif isinstance(node, Constant):
+            return self.constant(node.value)
+        elif isinstance(node, Variable):
+            return "(_v[%d] if _v[%d] is not None else _undefined(%r))" % (node.slot, node.slot, node.get_name())
+        elif type(node) in OPERATORS:
+            return "(%s %s %s)" % (self.expression(node.left), OPERATORS[type(node)], self.expression(node.right))
+        elif isinstance(node, Pow):
+            return "%s.apply(%s, %s)" % (self.node(node), self.expression(node.expression),
+                                         self.expression(node.expression2))
+        elif isinstance(node, (BaseFunction, Not)):
+            return "%s.apply(%s)" % (self.node(node), self.expression(node.expression))
+        elif isinstance(node, (Print, Input)):
+            if node.value is None:
+                return "%s.apply()" % self.node(node)
+            return "%s.apply(%s)" % (self.node(node), self.expression(node.value))
+        elif isinstance(node, Array):
+            return "%s.apply(%s)" % (self.node(node), ", ".join(self.expression(e) for e in node.elements))
+        elif isinstance(node, CallFunction):
+            if node.name in self.sizes:
+                fast = "_fast%d()" % self.indexes[node.name]
+                if self.fast:
+                    return fast
+                return "(%s if _bulk(%d, %d) else _f[%r]())" % ((fast,) + self.sizes[node.name] + (node.name,))
+            return "_f[%r]()" % node.name
+        elif isinstance(node, FunctionDeclaration):
+            # Already registered while parsing, the declaration evaluates to itself !
+            return "_d[%r]" % node.name
+        raise LogicError("Cannot compile <%s>" % node)
+
+    def constant(self, value):
+        if type(value) is float and not math.isfinite(value):
+            return "float(%r)" % repr(value)  # inf & nan, e.g. folded from 1e308 * 10 !
+        return repr(value)
+
+    def node(self, node):
+        return "_n[%r]" % type(node).__name__
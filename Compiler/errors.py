@@ -6,6 +6,11 @@ class LogicError(Exception):
         return self.message
 
 
+class StaticTypeError(LogicError):
+    # Raised by the type inference pass, before the program runs !
+    pass
+
+
 class UnexpectedEndError(Exception):
     message = 'Unexpected end of statement'
 
@@ -28,4 +33,18 @@ class ImmutableError(Exception):
         self.name = name
 
     def __str__(self):
-        return self.message % self.name
\ No newline at end of file
+        return self.message % self.name
+
+
+class BudgetExceededError(Exception):
+    # Raised when a run goes over one of the limits of its Budget, `usage` holds what it used so far !
+    message = '%s budget of %s exceeded (%s)'
+
+    def __init__(self, resource, limit, usage):
+        self.resource = resource
+        self.limit = limit
+        self.usage = usage
+
+    def __str__(self):
+        return self.message % (self.resource.capitalize(), self.limit,
+                               ", ".join("%s=%s" % item for item in self.usage.items()))
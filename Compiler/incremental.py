@@ -0,0 +1,222 @@
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from .lexer import Lexer
+from .parser import Parser, ParserState
+from .AbstractSyntaxTree import *
+
+
+def split_statements(tokens):
+    # Group a token list by top-level statement_full: `... ;` or `... { ... }` not followed by ELSE !
+    groups, group, depth = [], [], 0
+    for i, token in enumerate(tokens):
+        group.append(token)
+        kind = token.gettokentype()
+        if kind == '{':
+            depth += 1
+        elif kind == '}':
+            depth -= 1
+        if depth == 0 and (kind == ';' or kind == '}' and (
+                i + 1 == len(tokens) or tokens[i + 1].gettokentype() != 'ELSE')):
+            groups.append(group)
+            group = []
+    if group:
+        groups.append(group)
+    return groups
+
+
+def declarations(node, names):
+    # Every FunctionDeclaration registers itself in the state while parsing, even inside a block !
+    if isinstance(node, FunctionDeclaration):
+        names.append(node.name)
+        declarations(node.block, names)
+    elif isinstance(node, (Program, Block)):
+        for statement in node.statements:
+            declarations(statement, names)
+    elif isinstance(node, If):
+        declarations(node.body, names)
+        if node.else_body is not None:
+            declarations(node.else_body, names)
+    return names
+
+
+def common_length(same, limit):
+    # Longest n <= limit with same(n), by bisection so the slices are compared in C !
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if same(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class IncrementalParser:
+    """Keep the tokens & AST of the last parse, and re-parse only the edited top-level statements.
+
+    parse(source) does a full parse, update(source) diffs the new source
+    against the previous one, re-lexes & re-parses the top-level statements
+    touching the edit (and one neighbour on each side, so an added `else`
+    or a removed `;` joins them correctly) and splices the result into the
+    same Main, Program.statements and ParserState.functions. edit(start,
+    end, text) takes the edit's bounds, so it doesn't diff the sources.
+
+    The statements after an edit are only moved lazily: their offsets & the
+    idx of their tokens lag `shift` characters behind from statement
+    `shifted` on, the gap is closed only between two edits. sync() brings
+    every token position (idx, line & column) up to date, syntax() calls it.
+    """
+
+    def __init__(self, lexer=None, parser=None):
+        self.lexer = lexer or Lexer(fast=True).build()  # Scanner, which can lex a slice of the source !
+        self.parser = parser or Parser().build()
+        self.source = ""
+        self.state = None
+        self.main = None
+        self.tokens = []  # Tokens of each top-level statement
+        self.starts = []  # Source offsets of each top-level statement
+        self.ends = []
+        self.declared = Counter()  # Function name -> number of declarations in the program
+        self.reparsed = (0, 0)  # Statements [first, last) replaced by the last update, for stats
+        self.shifted = 0  # Statements from this one on are `shift` characters further than their offsets say
+        self.shift = 0
+        self.stale = 0  # Line & column numbers of the tokens are stale from this statement on
+
+    def parse(self, source, state=None):
+        state = state or ParserState()
+        tokens = list(self.lexer.lex(source))
+        main = self.parser.parse(iter(tokens), state=state)
+        groups = split_statements(tokens)
+        self.source, self.state, self.main, self.tokens = source, state, main, groups
+        self.starts = [group[0].getsourcepos().idx for group in groups]
+        self.ends = [group[-1].getsourcepos().idx + len(group[-1].getstr()) for group in groups]
+        self.declared = Counter(declarations(main.program, []))
+        self.reparsed = (0, len(groups))
+        self.shifted, self.shift, self.stale = len(groups), 0, len(groups)
+        return main
+
+    def fresh_state(self):
+        # New state for a full re-parse, keeping the function memo (if any) !
+        state = ParserState()
+        if self.state is not None and self.state.memo is not None:
+            state.memo = self.state.memo
+            state.memo.state = state
+            state.memo.reset()
+        return state
+
+    def edit(self, start, end, text):
+        # Editor style edit, replace source[start:end] by text !
+        return self.splice(self.source[:start] + text + self.source[end:], start, end)
+
+    def update(self, source):
+        old = self.source
+        if source == old and self.main is not None:
+            self.reparsed = (0, 0)
+            return self.main
+        # The edit replaced old[prefix:old_end] by source[prefix:old_end + delta] !
+        limit = min(len(old), len(source))
+        prefix = common_length(lambda n: old[:n] == source[:n], limit)
+        suffix = common_length(lambda n: old[len(old) - n:] == source[len(source) - n:], limit - prefix)
+        return self.splice(source, prefix, len(old) - suffix)
+
+    def splice(self, source, prefix, old_end):
+        # Re-parse around old[prefix:old_end], which became source[prefix:old_end + delta] !
+        if self.main is None or not self.tokens:
+            return self.parse(source, self.state)
+        delta = len(source) - len(self.source)
+
+        # Statements touching the edit, found by bisection, plus one neighbour on each side !
+        starts, ends = self.starts, self.ends
+        first = min(self.bisect(ends, prefix, bisect_left), len(ends) - 1)
+        last = max(self.bisect(starts, old_end, bisect_right) - 1, first)
+        first, last = max(first - 1, 0), min(last + 1, len(starts) - 1)
+        start, end = min(self.offset(starts, first), prefix), max(self.offset(ends, last), old_end)
+
+        program, state = self.main.program, self.state
+        removed = []
+        for statement in program.statements[first:last + 1]:
+            declarations(statement, removed)
+        tokens = list(self.lexer.lex(source, start, end + delta))
+        if not tokens:
+            return self.parse(source, self.fresh_state())
+        functions = dict(state.functions)
+        try:
+            segment = self.parser.parse(iter(tokens), state=state).program
+        except Exception:
+            state.functions = functions
+            raise
+        added = declarations(segment, [])
+        declared = self.declared - Counter(removed)
+        if any(declared[name] for name in set(removed) | set(added)):
+            # Another statement declares the same function, which one wins depends on the order !
+            state.functions = functions
+            return self.parse(source, self.fresh_state())
+        groups = split_statements(tokens)
+        if len(groups) != len(segment.statements):
+            state.functions = functions
+            return self.parse(source, self.fresh_state())
+
+        for name in removed:
+            if name not in added:
+                del state.functions[name]
+        # The statements after the edit move by `delta` on top of the pending shift: only the ones between the
+        # pending shift and the edit are moved now, so that one shift covers every statement after the edit !
+        if self.shifted < first:
+            self.move(self.shifted, first, self.shift)
+        elif self.shifted > last + 1:
+            self.move(last + 1, self.shifted, -self.shift)
+        program.statements[first:last + 1] = segment.statements
+        self.tokens[first:last + 1] = groups
+        starts[first:last + 1] = [group[0].getsourcepos().idx for group in groups]
+        ends[first:last + 1] = [group[-1].getsourcepos().idx + len(group[-1].getstr()) for group in groups]
+        self.shifted, self.shift = first + len(groups), self.shift + delta
+        self.stale = min(self.stale, first + len(groups))
+        if state.memo is not None:
+            state.memo.reset()
+        self.declared = declared + Counter(added)
+        self.source = source
+        self.reparsed = (first, first + len(groups))
+        return self.main
+
+    def offset(self, offsets, i):
+        # Actual source offset of statement i, from self.starts or self.ends !
+        return offsets[i] + self.shift if i >= self.shifted else offsets[i]
+
+    def bisect(self, offsets, offset, search):
+        # bisect_left/right on the actual offsets, offsets[:shifted] are exact and the others lag `shift` behind !
+        shifted = self.shifted
+        if shifted and (offsets[shifted - 1] > offset or search is bisect_left and offsets[shifted - 1] == offset):
+            return search(offsets, offset, 0, shifted)
+        return search(offsets, offset - self.shift, shifted, len(offsets))
+
+    def move(self, first, last, delta):
+        # Move statements [first, last) by delta characters: their offsets and the idx of their tokens !
+        starts, ends = self.starts, self.ends
+        for i in range(first, last):
+            starts[i] += delta
+            ends[i] += delta
+            for token in self.tokens[i]:
+                token.source_pos.idx += delta
+
+    def sync(self):
+        # Apply the pending shift and recount the lines & columns of the tokens after the edits !
+        self.move(self.shifted, len(self.tokens), self.shift)
+        self.shifted, self.shift = len(self.tokens), 0
+        if self.stale < len(self.tokens):
+            source, previous = self.source, self.starts[self.stale]
+            lineno, last_nl = source.count("\n", 0, previous) + 1, source.rfind("\n", 0, previous)
+            for group in self.tokens[self.stale:]:
+                for token in group:
+                    position = token.source_pos
+                    newlines = source.count("\n", previous, position.idx)
+                    if newlines:
+                        lineno += newlines
+                        last_nl = source.rfind("\n", previous, position.idx)
+                    position.lineno, position.colno = lineno, position.idx - last_nl
+                    previous = position.idx
+            self.stale = len(self.tokens)
+        return self.main
+
+    def syntax(self):
+        # Syntax tree of the program, with the actual positions of its tokens !
+        return self.sync().syntax()
@@ -1,7 +1,49 @@
+import re
+from array import array
 from rply import LexerGenerator
+from rply.errors import LexingError
+from rply.token import SourcePosition, Token
+
+# Reserved words, looked up after the scanner read a whole identifier !
+KEYWORDS = {
+    'true': 'BOOLEAN', 'false': 'BOOLEAN', 'True': 'BOOLEAN', 'False': 'BOOLEAN', 'TRUE': 'BOOLEAN', 'FALSE': 'BOOLEAN',
+    'and': 'AND', 'or': 'OR', 'if': 'IF', 'else': 'ELSE', 'not': 'NOT', 'let': 'LET',
+    'input': 'CONSOLE_INPUT', 'function': 'FUNCTION', 'print': 'PRINT',
+    'abs': 'ABSOLUTE', 'sin': 'SIN', 'cos': 'COS', 'tan': 'TAN', 'pow': 'POWER',
+}
+
+# One master pattern, the alternatives keep the priority of the LexerGenerator rules !
+SCANNER = re.compile(r'''
+    (?P<SPACE>\s+)
+  | (?P<E>-?__E__)
+  | (?P<PI>-?__PI__)
+  | (?P<FLOAT>-?\d+\.\d+)
+  | (?P<INTEGER>-?\d+)
+  | (?P<QUOTE>"""|"|')
+  | (?P<OPERATOR>==|!=|>=|<=|[-+*/><=;,(){}\[\]])
+  | (?P<IDENTIFIER>[a-zA-Z_][a-zA-Z0-9_]*)
+''', re.VERBOSE)
+
+OPERATORS = {
+    '+': 'SUM', '-': 'SUB', '*': 'MUL', '/': 'DIV',
+    '==': '==', '!=': '!=', '>=': '>=', '<=': '<=', '>': '>', '<': '<', '=': '=',
+    ';': ';', ',': ',', '(': '(', ')': ')', '{': '{', '}': '}', '[': '[', ']': ']',
+}
+
+
+# Every token type of the language, a TokenBuffer stores the index in this tuple !
+TOKEN_TYPES = (
+    'E', 'PI', 'FLOAT', 'INTEGER', 'STRING', 'BOOLEAN', 'SUM', 'SUB', 'MUL', 'DIV',
+    'AND', 'OR', '==', '!=', '>=', '<=', '>', '<', '=', 'IF', 'ELSE', 'NOT', ';', ',', '(', ')', '{', '}', '[', ']',
+    'CONSOLE_INPUT', 'FUNCTION', 'PRINT', 'ABSOLUTE', 'SIN', 'COS', 'TAN', 'POWER', 'LET', 'IDENTIFIER',
+)
+TOKEN_IDS = {name: i for i, name in enumerate(TOKEN_TYPES)}
+
 
 class Lexer:
-    def __init__(self):
+    def __init__(self, fast=False):
+        # fast=True builds the single pass Scanner instead of rply's rule by rule lexer !
+        self.fast = fast
         self.lexer = LexerGenerator()
         self.__add_tokens()
 
@@ -40,6 +82,9 @@ class Lexer:
         self.lexer.add(')', r'\)')
         self.lexer.add('{', r'\{')
         self.lexer.add('}', r'\}')
+        # Array literal
+        self.lexer.add('[', r'\[')
+        self.lexer.add(']', r'\]')
         # Function
         self.lexer.add('CONSOLE_INPUT', r'input')
         self.lexer.add('FUNCTION', r'function')
@@ -58,4 +103,107 @@ class Lexer:
         # self.lexer.add('OPT_LINE', r'\n*')
 
     def build(self):
-        return self.lexer.build()
\ No newline at end of file
+        if self.fast is True:
+            return Scanner()
+        return self.lexer.build()
+
+
+class Scanner:
+    """Lexer backend matching one combined regex per token.
+
+    Identifiers are scanned whole and then looked up in KEYWORDS, so names
+    such as `printer` or `sinus` stay one IDENTIFIER. String literals end at
+    the nearest closing quote on the same line instead of the last one.
+    """
+
+    def lex(self, s, start=0, end=None):
+        return self.tokens(s, start, end)
+
+    def tokens(self, s, start=0, end=None):
+        # Only s[start:end] is scanned, positions are still those in the whole of s !
+        match = SCANNER.match
+        keywords, operators = KEYWORDS, OPERATORS
+        idx, lineno, last_nl = start, s.count("\n", 0, start) + 1, s.rfind("\n", 0, start)
+        end = len(s) if end is None else end
+        while idx < end:
+            m = match(s, idx, end)
+            if m is None:
+                raise LexingError(None, SourcePosition(idx, lineno, idx - last_nl))
+            kind = m.lastgroup
+            stop = m.end()
+            if kind == 'SPACE':
+                newlines = s.count("\n", idx, stop)
+                if newlines:
+                    lineno += newlines
+                    last_nl = s.rfind("\n", idx, stop)
+                idx = stop
+                continue
+            if kind == 'IDENTIFIER':
+                kind = keywords.get(m.group(), 'IDENTIFIER')
+            elif kind == 'OPERATOR':
+                kind = operators[m.group()]
+            elif kind == 'QUOTE':
+                kind, stop = 'STRING', self.string_end(s, idx, m.group(), end)
+                if stop < 0:
+                    raise LexingError(None, SourcePosition(idx, lineno, idx - last_nl))
+            yield Token(kind, s[idx:stop], SourcePosition(idx, lineno, idx - last_nl))
+            idx = stop
+
+    def string_end(self, s, idx, quote, end):
+        # Strings never span lines, so only look for the closing quote up to the line end !
+        line_end = s.find("\n", idx, end)
+        if line_end < 0:
+            line_end = end
+        if quote == '"""':
+            close = s.find('"""', idx + 3, line_end)
+            if close >= 0:
+                return close + 3
+            quote = '"'
+        close = s.find(quote, idx + 1, line_end)
+        return close + 1 if close >= 0 else -1
+
+
+class TokenBuffer:
+    """Token stream lexed once into parallel arrays instead of a list of Token objects.
+
+    Type ids, start/end offsets, line & column numbers are kept in `array`s
+    and lexemes are sliced from the source only when asked for. Iterating
+    the buffer rebuilds the rply Tokens one at a time, so it can be passed to
+    parser.parse(iter(buffer)) as many times as needed without re-lexing.
+    """
+
+    __slots__ = ('source', 'types', 'starts', 'ends', 'lines', 'columns')
+
+    def __init__(self, source, tokens):
+        self.source = source
+        self.types = array('B')
+        self.starts = array('l')
+        self.ends = array('l')
+        self.lines = array('l')
+        self.columns = array('l')
+        ids = TOKEN_IDS
+        for token in tokens:
+            position = token.source_pos
+            self.types.append(ids[token.name])
+            self.starts.append(position.idx)
+            self.ends.append(position.idx + len(token.value))
+            self.lines.append(position.lineno)
+            self.columns.append(position.colno)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, i):
+        return Token(TOKEN_TYPES[self.types[i]], self.source[self.starts[i]:self.ends[i]],
+                     SourcePosition(self.starts[i], self.lines[i], self.columns[i]))
+
+    def __iter__(self):
+        source, types = self.source, TOKEN_TYPES
+        for kind, start, end, line, column in zip(self.types, self.starts, self.ends, self.lines, self.columns):
+            yield Token(types[kind], source[start:end], SourcePosition(start, line, column))
+
+    def type(self, i):
+        return TOKEN_TYPES[self.types[i]]
+
+    def lexeme(self, i):
+        return self.source[self.starts[i]:self.ends[i]]
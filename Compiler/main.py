@@ -1,8 +1,10 @@
-from .lexer import Lexer
+from .lexer import Lexer, TokenBuffer
 from .parser import Parser, ParserState
 from .JSONparsedTree import Node, write
-from rply.lexer import LexerStream
-from copy import copy
+from .optimizer import ConstantFolder
+from .typecheck import TypeInference
+from .profiler import Instrumentation
+from .output import BufferedSink
 from pprint import pprint
 import traceback
 
@@ -67,14 +69,17 @@ function main() {
 main();
 """
 
-lexer = Lexer().build()  # Build the lexer using LexerGenerator
-tokens: LexerStream
+profile = Instrumentation()  # Time & counters of every phase, summarized at the end !
+with profile.phase("Lexer.build"):
+    lexer = Lexer().build()  # Build the lexer using LexerGenerator
+tokens: TokenBuffer
 try:
-    # Stream the input to analysis the lexical syntax
-    tokens = lexer.lex(call_declared_functions)
-    tokenType = map(lambda x: x.gettokentype(), copy(tokens))
-    tokenName = map(lambda x: x.getstr(), copy(tokens))
-    pprint(list(copy(tokens)))
+    # Lex the input only once into a compact buffer, every consumer below iterates it again !
+    with profile.phase("lex"):
+        tokens = TokenBuffer(call_declared_functions, profile.count_tokens(lexer.lex(call_declared_functions)))
+    tokenType = map(tokens.type, range(len(tokens)))
+    tokenName = map(tokens.lexeme, range(len(tokens)))
+    pprint(list(tokens))
     # pprint(list(copy(tokenType)))
     # pprint(list(copy(tokenName)))
 except (BaseException, Exception):
@@ -83,18 +88,30 @@ finally:
     print("Finish lexical analysis !")
 
 SymbolTable = ParserState()
+SymbolTable.output = BufferedSink()  # Batch print() output, flushed before input() prompts & at program end !
 syntaxRoot: Node
 semanticRoot = Node("main")
 try:
-    syntaxRoot = Node("main", Parser(syntax=True).build().parse(
-        copy(tokens), state=SymbolTable))  # Get syntax tree !
-    Parser().build().parse(copy(tokens), state=SymbolTable).eval(
-        semanticRoot)  # Get semantic tree !
+    with profile.phase("Parser.build"):
+        parser = Parser(instrumentation=profile).build()
+    with profile.phase("parse"):
+        program = parser.parse(iter(tokens), state=SymbolTable)  # Parse once !
+    with profile.phase("syntax"):
+        syntaxRoot = Node("main", program.syntax())  # Get syntax tree !
+    with profile.phase("fold"):
+        program = ConstantFolder(SymbolTable).fold(program)  # Fold constant expressions before evaluating !
+    with profile.phase("types"):
+        program = TypeInference(SymbolTable).infer(program)  # Reject mistyped programs & specialize typed builtins !
+    with profile.phase("eval"):
+        program.eval(semanticRoot)  # Get semantic tree !
 except (BaseException, Exception):
     traceback.print_exc()
 finally:
-    write(syntaxRoot, "SyntaxAnalyzer")
-    write(semanticRoot, "SemanticAnalyzer")
+    with profile.phase("write"):
+        write(syntaxRoot, "SyntaxAnalyzer")
+        write(semanticRoot, "SemanticAnalyzer")
     print("------------------------------Declared Variables & Functions are:------------------------------")
     pprint(SymbolTable.variables)
     pprint(SymbolTable.functions)
+    print("------------------------------Compile Pipeline Profile:------------------------------")
+    print(profile.summary())
@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from .AbstractSyntaxTree import *
+
+
+class FunctionMemo:
+    """Bounded LRU cache of the results of pure user-defined functions.
+
+    A function is pure when its block (and every function it calls) has no
+    print, input or let, functions take no arguments so the result only
+    depends on the global variables read. They are part of the key, so a
+    result computed while a global was undefined is not reused once it's
+    defined. Enable it with `state.memo = FunctionMemo(state, size)`, every
+    backend (AST, bytecode VM & generated Python) then uses it.
+    """
+
+    def __init__(self, state, size=128):
+        self.state = state
+        self.size = size
+        self.cache = OrderedDict()
+        self.pure = {}  # FunctionDeclaration -> tuple of the slots it reads, None when impure
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self):
+        # Functions were re-declared (e.g. by an incremental parse), purity & results may be stale !
+        self.cache.clear()
+        self.pure.clear()
+
+    def reads(self, function):
+        if function in self.pure:
+            return self.pure[function]
+        self.pure[function] = None  # Recursive calls are never pure, they'd be computed forever anyway !
+        slots = set()
+        if self.visit(function.block, slots):
+            self.pure[function] = tuple(sorted(slots))
+        return self.pure[function]
+
+    def visit(self, node, slots):
+        if isinstance(node, (Print, Input, Assignment)):
+            return False
+        elif isinstance(node, Variable):
+            slots.add(node.slot)
+            return True
+        elif isinstance(node, CallFunction):
+            function = self.state.functions.get(node.name)
+            reads = None if function is None else self.reads(function)
+            if reads is None:
+                return False
+            slots.update(reads)
+            return True
+        elif isinstance(node, (Program, Block)):
+            return all(self.visit(statement, slots) for statement in node.statements)
+        elif isinstance(node, StatementFull):
+            return self.visit(node.statement, slots)
+        elif isinstance(node, (Statement, ExpressParenthesis, BaseFunction, Not)):
+            if isinstance(node, Pow) and not self.visit(node.expression2, slots):
+                return False
+            return self.visit(node.expression, slots)
+        elif isinstance(node, If):
+            return self.visit(node.condition, slots) and self.visit(node.body, slots) and (
+                node.else_body is None or self.visit(node.else_body, slots))
+        elif isinstance(node, BinaryOp):
+            return self.visit(node.left, slots) and self.visit(node.right, slots)
+        elif isinstance(node, Array):
+            return all(self.visit(element, slots) for element in node.elements)
+        return isinstance(node, (Constant, FunctionDeclaration))
+
+    def key(self, function, mode):
+        reads = self.reads(function)
+        if reads is None:
+            return None
+        values = self.state.values
+        # The type is part of the key, 1 == 1.0 == True but they don't print the same !
+        key = (function, mode) + tuple((type(values[slot]), values[slot]) for slot in reads)
+        try:
+            hash(key)
+        except TypeError:  # e.g. a NumPy array global, such calls aren't cached !
+            return None
+        return key
+
+    def lookup(self, key):
+        entry = self.cache.get(key)
+        if entry is not None:
+            self.cache.move_to_end(key)
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def store(self, key, entry):
+        self.cache[key] = entry
+        if len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def run(self, function):
+        return self.call(function, function.block.run)
+
+    def call(self, function, run):
+        # `run` computes the function's result, e.g. its block's run() or the function generated from it !
+        key = self.key(function, "run")
+        if key is None:
+            return run()
+        entry = self.lookup(key)
+        if entry is None:
+            entry = (run(),)
+            self.store(key, entry)
+        return entry[0]
+
+    def eval(self, function, identifier):
+        # The traced subtree is cached with the result, so the semantic tree stays the same !
+        key = self.key(function, "eval")
+        if key is None:
+            return function.block.eval(identifier)
+        entry = self.lookup(key)
+        if entry is None:
+            value = function.block.eval(identifier)
+            entry = (value, list(identifier.children))
+            self.store(key, entry)
+        else:
+            identifier.children.extend(entry[1])
+        return entry[0]
@@ -0,0 +1,79 @@
+from rply.token import Token
+from .AbstractSyntaxTree import *
+
+# Only these leaves are known before the program runs !
+FOLDABLE_CONSTANTS = (Integer, Float, Boolean, ConstantPI, ConstantE)
+
+
+class ConstantFolder:
+    """Replace pure constant subtrees of the AST by a single Constant.
+
+    Runs between parsing and evaluation. A subtree is folded by running it
+    once, so the result is exactly what eval() would have computed, builtin
+    rounding included. Subtrees that raise (1 / 0, sin(true), ...) are kept
+    so the error still happens at run time.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.folded = 0
+
+    def fold(self, main):
+        main.program = self.visit(main.program)
+        for function in self.state.functions.values():
+            function.block = self.visit(function.block)
+        return main
+
+    def visit(self, node):
+        if isinstance(node, (Program, Block)):
+            node.statements = [self.visit(statement) for statement in node.statements]
+        elif isinstance(node, StatementFull):
+            node.statement = self.visit(node.statement)
+        elif isinstance(node, If):
+            node.condition = self.visit(node.condition)
+            node.body = self.visit(node.body)
+            if node.else_body is not None:
+                node.else_body = self.visit(node.else_body)
+        elif isinstance(node, Assignment):
+            node.right = self.visit(node.right)
+        elif isinstance(node, (Print, Input)):
+            if node.value is not None:
+                node.value = self.visit(node.value)
+        elif isinstance(node, Array):
+            node.elements = [self.visit(element) for element in node.elements]
+        elif isinstance(node, Statement):
+            node.expression = self.visit(node.expression)
+        elif isinstance(node, BinaryOp):
+            node.left = self.visit(node.left)
+            node.right = self.visit(node.right)
+            if self.constant(node.left) and self.constant(node.right):
+                return self.evaluate(node)
+        elif isinstance(node, Pow):
+            node.expression = self.visit(node.expression)
+            node.expression2 = self.visit(node.expression2)
+            if self.constant(node.expression) and self.constant(node.expression2):
+                return self.evaluate(node)
+        elif isinstance(node, (BaseFunction, Not, ExpressParenthesis)):
+            node.expression = self.visit(node.expression)
+            if self.constant(node.expression):
+                return self.evaluate(node)
+        return node
+
+    def constant(self, node):
+        return isinstance(node, FOLDABLE_CONSTANTS)
+
+    def evaluate(self, node):
+        try:
+            value = node.run()
+        except (ArithmeticError, LogicError, TypeError, ValueError):
+            return node
+        if isinstance(value, bool):
+            constant = Boolean(str(value), self.state, token=Token("BOOLEAN", str(value)))
+        elif isinstance(value, int):
+            constant = Integer(value, self.state, token=Token("INTEGER", str(value)))
+        elif isinstance(value, float):
+            constant = Float(value, self.state, token=Token("FLOAT", repr(value)))
+        else:
+            return node
+        self.folded += 1
+        return constant
@@ -0,0 +1,52 @@
+import sys
+
+
+class StreamSink:
+    """Write every print straight to a stream, sys.stdout (looked up at each write) by default."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, text):
+        (self.stream or sys.stdout).write(text)
+
+    def flush(self):
+        (self.stream or sys.stdout).flush()
+
+
+class BufferedSink(StreamSink):
+    """Batch the output in memory, written to the stream in one go every `threshold` characters and at program end."""
+
+    def __init__(self, stream=None, threshold=1 << 16):
+        super().__init__(stream)
+        self.threshold = threshold
+        self.parts = []
+        self.size = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            (self.stream or sys.stdout).write("".join(self.parts))
+            self.parts, self.size = [], 0
+        super().flush()
+
+
+class MemorySink:
+    """Keep the whole output (input prompts included) in memory, for tests & embedding."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, text):
+        self.parts.append(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return "".join(self.parts)
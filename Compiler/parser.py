@@ -1,5 +1,13 @@
+import json
+import os
+import tempfile
+import warnings
+from appdirs import AppDirs
 from rply import ParserGenerator
-from .JSONparsedTree import Node
+from rply.errors import ParserGeneratorWarning
+from rply.grammar import Grammar
+from rply.parser import LRParser
+from rply.parsergenerator import LRTable
 from .AbstractSyntaxTree import *
 from .errors import *
 
@@ -7,19 +15,147 @@ from .errors import *
 # State instance which gets passed to parser !
 class ParserState(object):
     def __init__(self):
-        # We want to hold a dict of global-declared variables & functions.
-        self.variables = {}
+        # We want to hold the global-declared variables & functions.
+        # Each variable name gets a fixed slot while parsing, its value lives at that index of `values` !
+        self.slots = {}
+        self.names = []
+        self.values = []
         self.functions = {}
+        self.memo = None  # FunctionMemo caching the results of pure functions, off by default !
+        self.output = None  # Sink of print() & input() prompts (see output.py), None writes straight to stdout !
+        self.input = None  # Called like input() to read a value, None reads stdin !
+        self.budget = None  # Budget limiting every run of the program (see budget.py), None is unlimited !
         pass  # End ParserState's constructor !
 
+    def slot(self, name):
+        index = self.slots.get(name)
+        if index is None:
+            index = self.slots[name] = len(self.names)
+            self.names.append(name)
+            self.values.append(None)  # None means not yet defined !
+        return index
+
+    @property
+    def variables(self):
+        # Dict view of the defined variables, for printing & debugging only !
+        return {name: value for name, value in zip(self.names, self.values) if value is not None}
+
+    def reset(self):
+        # Undefine every variable, so the same parsed program can run again from scratch !
+        self.values[:] = [None] * len(self.values)
+
+    def start(self):
+        # Called when a run begins, so the budget (if any) counts this run only !
+        if self.budget is not None:
+            self.budget.start()
+
+    def finish(self):
+        # Called when a run ends, the time since the budget's last check counts too !
+        if self.budget is not None:
+            self.budget.check()
+
+    def overflow(self, error):
+        # A RecursionError ends a budgeted run like any other overrun, the stack is unwound by now !
+        if self.budget is not None:
+            self.budget.overflow()
+        raise error
+
+    def flush(self):
+        # Called once the program ended (or failed), so buffered output is never lost !
+        if self.output is not None:
+            self.output.flush()
+
+    def bind(self, name, value):
+        # Define a variable from the host, e.g. a NumPy array of samples, before the program runs !
+        self.values[self.slot(name)] = value
+
+
+# LALR tables which were already built or loaded by this process, keyed by grammar hash !
+_tables = {}
+
+
+class CachedParserGenerator(ParserGenerator):
+    """ParserGenerator which keeps the LALR tables in memory and on disk.
+
+    The tables are keyed on rply's hash of the start symbol, terminals,
+    precedence and productions, so every Parser mode with the same grammar
+    shares one entry. A table loaded from disk is validated against the
+    grammar before use and rebuilt when it doesn't match. The file is plain
+    JSON like rply's own cache, loading it never runs code.
+    """
+
+    def __init__(self, tokens, precedence=[], cache_dir=None):
+        super().__init__(tokens, precedence, cache_id="ppl")
+        if cache_dir is None:
+            cache_dir = AppDirs("ppl").user_cache_dir
+        self.cache_dir = cache_dir
+
+    def build(self):
+        g = Grammar(self.tokens)
+        for level, (assoc, terms) in enumerate(self.precedence, 1):
+            for term in terms:
+                g.set_precedence(term, assoc, level)
+        for prod_name, syms, func, precedence in self.productions:
+            g.add_production(prod_name, syms, func, precedence)
+        g.set_start()
+
+        key = "%s-%s-%s" % (self.cache_id, self.VERSION, self.compute_grammar_hash(g))
+        data = _tables.get(key)
+        if data is None:
+            data = self._read_table(g, key)
+        if data is None:
+            for unused_term in g.unused_terminals():
+                warnings.warn("Token %r is unused" % unused_term, ParserGeneratorWarning, stacklevel=2)
+            for unused_prod in g.unused_productions():
+                warnings.warn("Production %r is not reachable" % unused_prod, ParserGeneratorWarning, stacklevel=2)
+            g.build_lritems()
+            g.compute_first()
+            g.compute_follow()
+            data = self.serialize_table(LRTable.from_grammar(g))
+            # Same layout as rply's JSON cache, which data_is_valid() expects !
+            data["precedence"] = {term: list(prec) for term, prec in data["precedence"].items()}
+            self._write_table(key, data)
+        _tables[key] = data
+
+        # Production callbacks live in the grammar, so the cached data only holds plain tables !
+        table = LRTable(g, data["lr_action"], data["lr_goto"], data["default_reductions"],
+                        data["sr_conflicts"], data["rr_conflicts"])
+        if table.sr_conflicts:
+            warnings.warn("%d shift/reduce conflicts" % len(table.sr_conflicts), ParserGeneratorWarning, stacklevel=2)
+        if table.rr_conflicts:
+            warnings.warn("%d reduce/reduce conflicts" % len(table.rr_conflicts), ParserGeneratorWarning, stacklevel=2)
+        return LRParser(table, self.error_handler)
+
+    def _read_table(self, g, key):
+        try:
+            with open(os.path.join(self.cache_dir, key + ".json")) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            if self.data_is_valid(g, data):
+                return data
+        except (KeyError, TypeError, ValueError):
+            pass
+        return None  # Stale or corrupted cache file, so rebuild it !
+
+    def _write_table(self, key, data):
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.cache_dir, delete=False) as f:
+                json.dump(data, f)
+            os.replace(f.name, os.path.join(self.cache_dir, key + ".json"))
+        except OSError:
+            pass  # A read-only cache only costs us the rebuild next time !
+
 
 class Parser:
-    def __init__(self, syntax=False):
-        self.pg = ParserGenerator(
+    def __init__(self, syntax=False, cache_dir=None, instrumentation=None):
+        self.pg = CachedParserGenerator(
             # A list of all token names accepted by the parser.
             ['STRING', 'INTEGER', 'FLOAT', 'BOOLEAN', 'PI', 'E',
              'PRINT', 'ABSOLUTE', 'SIN', 'COS', 'TAN', 'POWER',
-             'CONSOLE_INPUT', '(', ')', ';', ',', '{', '}',
+             'CONSOLE_INPUT', '(', ')', ';', ',', '{', '}', '[', ']',
              'LET', 'AND', 'OR', 'NOT', 'IF', 'ELSE',
              '=', '==', '!=', '>=', '>', '<', '<=',
              'SUM', 'SUB', 'MUL', 'DIV', 'IDENTIFIER', 'FUNCTION'
@@ -37,92 +173,78 @@ class Parser:
                 ('left', ['SUM', 'SUB']),
                 ('left', ['MUL', 'DIV']),
                 ('left', ['STRING', 'INTEGER', 'FLOAT', 'BOOLEAN', 'PI', 'E'])
-            )
+            ),
+            # Where the LALR tables get cached, default to the user's cache directory.
+            cache_dir=cache_dir
         )
         self.syntax = syntax
         self.parse()
+        if instrumentation is not None:
+            # Count the reductions of every production, the grammar (and its cached tables) stays the same !
+            self.pg.productions = [
+                (name, symbols, instrumentation.counted("%s : %s" % (name, " ".join(symbols)), function), precedence)
+                for name, symbols, function, precedence in self.pg.productions]
         pass  # End Parser's constructor !
 
     def parse(self):
         @self.pg.production("main : program")
         def main_program(state, p):
             if self.syntax is True:
-                return [Node("program", p[0])]
+                # The syntax tree is derived from the AST, so both views come from one parse !
+                return Main(p[0]).syntax()
             return Main(p[0])
 
         @self.pg.production('program : statement_full')
         def program_statement(state, p):
-            if self.syntax is True:
-                return [Node("statement_full", p[0])]
-            return Program(p[0], None, state)
+            return Program(p[0], state)
 
-        @self.pg.production('program : statement_full program')
-        def program_statement_program(state, p):
-            if self.syntax is True:
-                return [Node("statement_full", p[0]), Node("program", p[1])]
-            return Program(p[0], p[1], state)
+        # Left recursive, so each statement is reduced as soon as it's read and appended in O(1) !
+        @self.pg.production('program : program statement_full')
+        def program_program_statement(state, p):
+            p[0].add_statement(p[1])
+            return p[0]
 
         @self.pg.production('expression : ( expression )')
         def expression_parenthesis(state, p):
             # In this case we need parenthesis only for precedence
             # so we just need to return the inner expression
-            if self.syntax is True:
-                return [Node("("), Node("expression", p[1]), Node(")")]
             return ExpressParenthesis(p[1])
 
         @self.pg.production('statement_full : IF ( expression ) { block }')
         def expression_if(state, p):
-            if self.syntax is True:
-                return [Node("IF"), Node("("), Node("expression", p[2]), Node(")"), Node("{"), Node("block", p[5]), Node("}")]
             return If(condition=p[2], body=p[5], state=state)
 
         @self.pg.production('statement_full : IF ( expression ) { block } ELSE { block }')
         def expression_if_else(state, p):
-            if self.syntax is True:
-                return [Node("IF"), Node("("), Node("expression", p[2]), Node(")"), Node("{"), Node("block", p[5]), Node("}"), Node("ELSE"), Node("{"),
-                        Node("block", p[9]), Node("}")]
             return If(condition=p[2], body=p[5], else_body=p[9], state=state)
 
         @self.pg.production('block : statement_full')
         def block_expr(state, p):
-            if self.syntax is True:
-                return [Node("statement_full", p[0])]
-            return Block(p[0], None, state)
+            return Block(p[0], state)
 
-        @self.pg.production('block : statement_full block')
-        def block_expr_block(state, p):
-            if self.syntax is True:
-                return [Node("statement_full", p[0]), Node("block", p[1])]
-            return Block(p[0], p[1], state)
+        @self.pg.production('block : block statement_full')
+        def block_block_expr(state, p):
+            p[0].add_statement(p[1])
+            return p[0]
 
         @self.pg.production('statement_full : statement ;')
         def statement_full(state, p):
-            if self.syntax is True:
-                return [Node("statement", p[0]), Node(";")]
             return StatementFull(p[0])
 
         @self.pg.production('statement : expression')
         def statement_expr(state, p):
-            if self.syntax is True:
-                return [Node("expression", p[0])]
             return Statement(p[0])
 
         @self.pg.production('statement : LET IDENTIFIER = expression')
         def statement_assignment(state, p):
-            if self.syntax is True:
-                return [Node("LET"), Node("IDENTIFIER", p[1]), Node("="), Node("expression", p[3])]
-            return Assignment(Variable(p[1].getstr(), state), p[3], state)
+            return Assignment(Variable(p[1].getstr(), state, token=p[1]), p[3], state)
 
         @self.pg.production('statement_full : FUNCTION IDENTIFIER ( ) { block }')
         def statement_func_noargs(state, p):
-            if self.syntax is True:
-                return [Node("FUNCTION"), Node("IDENTIFIER", p[1]), Node("("), Node(")"), Node("{"), Node("block", p[5]), Node("}")]
-            return FunctionDeclaration(name=p[1].getstr(), args=None, block=p[5], state=state)
+            return FunctionDeclaration(name=p[1].getstr(), args=None, block=p[5], state=state, token=p[1])
 
         @self.pg.production('expression : NOT expression')
         def expression_not(state, p):
-            if self.syntax is True:
-                return [Node("NOT"), Node("expression", p[1])]
             return Not(p[1], state)
 
         @self.pg.production('expression : expression SUM expression')
@@ -131,20 +253,12 @@ class Parser:
         @self.pg.production('expression : expression DIV expression')
         def expression_binary_operator(state, p):
             if p[1].gettokentype() == 'SUM':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("+"), Node("expression", p[2])]
                 return Sum(p[0], p[2], state)
             elif p[1].gettokentype() == 'SUB':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("-"), Node("expression", p[2])]
                 return Sub(p[0], p[2], state)
             elif p[1].gettokentype() == 'MUL':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("*"), Node("expression", p[2])]
                 return Mul(p[0], p[2], state)
             elif p[1].gettokentype() == 'DIV':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("/"), Node("expression", p[2])]
                 return Div(p[0], p[2], state)
             else:
                 raise LogicError('Oops, this should not be possible!')
@@ -159,149 +273,111 @@ class Parser:
         @self.pg.production('expression : expression OR expression')
         def expression_equality(state, p):
             if p[1].gettokentype() == '==':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("=="), Node("expression", p[2])]
                 return Equal(p[0], p[2], state)
             elif p[1].gettokentype() == '!=':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("!="), Node("expression", p[2])]
                 return NotEqual(p[0], p[2], state)
             elif p[1].gettokentype() == '>=':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node(">="), Node("expression", p[2])]
                 return GreaterThanEqual(p[0], p[2], state)
             elif p[1].gettokentype() == '<=':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("<="), Node("expression", p[2])]
                 return LessThanEqual(p[0], p[2], state)
             elif p[1].gettokentype() == '>':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node(">"), Node("expression", p[2])]
                 return GreaterThan(p[0], p[2], state)
             elif p[1].gettokentype() == '<':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("<"), Node("expression", p[2])]
                 return LessThan(p[0], p[2], state)
             elif p[1].gettokentype() == 'AND':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("AND"), Node("expression", p[2])]
                 return And(p[0], p[2], state)
             elif p[1].gettokentype() == 'OR':
-                if self.syntax is True:
-                    return [Node("expression", p[0]), Node("OR"), Node("expression", p[2])]
                 return Or(p[0], p[2], state)
             else:
                 raise LogicError("Shouldn't be possible")
 
         @self.pg.production('expression : CONSOLE_INPUT ( )')
         def program(state, p):
-            if self.syntax is True:
-                return [Node("CONSOLE_INPUT"), Node("("), Node(")")]
-            return Input()
+            return Input(state=state)
 
         @self.pg.production('expression : CONSOLE_INPUT ( expression )')
         def program(state, p):
-            if self.syntax is True:
-                return [Node("CONSOLE_INPUT"), Node("("), Node("expression", p[2]), Node(")")]
             return Input(expression=p[2], state=state)
 
         @self.pg.production('statement : PRINT ( )')
         def program(state, p):
-            if self.syntax is True:
-                return [Node("PRINT"), Node("("), Node(")")]
-            return Print()
+            return Print(state=state)
 
         @self.pg.production('statement : PRINT ( expression )')
         def program(state, p):
-            if self.syntax is True:
-                return [Node("PRINT"), Node("("), Node("expression", p[2]), Node(")")]
             return Print(expression=p[2], state=state)
 
         @self.pg.production('expression : ABSOLUTE ( expression )')
         def expression_absolute(state, p):
-            if self.syntax is True:
-                return [Node("ABSOLUTE"), Node("("), Node("expression", p[2]), Node(")")]
             return Absolute(p[2], state)
 
         @self.pg.production('expression : SIN ( expression )')
         def expression_absolute(state, p):
-            if self.syntax is True:
-                return [Node("SIN"), Node("("), Node("expression", p[2]), Node(")")]
             return Sin(p[2], state)
 
         @self.pg.production('expression : COS ( expression )')
         def expression_absolute(state, p):
-            if self.syntax is True:
-                return [Node("COS"), Node("("), Node("expression", p[2]), Node(")")]
             return Cos(p[2], state)
 
         @self.pg.production('expression : TAN ( expression )')
         def expression_absolute(state, p):
-            if self.syntax is True:
-                return [Node("TAN"), Node("("), Node("expression", p[2]), Node(")")]
             return Tan(p[2], state)
 
         @self.pg.production('expression : POWER ( expression , expression )')
         def expression_absolute(state, p):
-            if self.syntax is True:
-                return [Node("POWER"), Node("("), Node("expression", p[2]), Node(","), Node("expression", p[4]), Node(")")]
             return Pow(p[2], p[4], state)
 
+        @self.pg.production('expression : [ elements ]')
+        def expression_array(state, p):
+            return p[1]
+
+        @self.pg.production('elements : expression')
+        def elements_expression(state, p):
+            return Array(p[0], state)
+
+        # Left recursive like program & block, so long literals parse in linear time !
+        @self.pg.production('elements : elements , expression')
+        def elements_elements_expression(state, p):
+            p[0].add_element(p[2])
+            return p[0]
+
         @self.pg.production('expression : IDENTIFIER')
         def expression_variable(state, p):
             # Cannot return the value of a variable if it isn't yet defined
-            if self.syntax is True:
-                return [Node("IDENTIFIER", p[0])]
-            return Variable(p[0].getstr(), state)
+            return Variable(p[0].getstr(), state, token=p[0])
 
         @self.pg.production('expression : IDENTIFIER ( )')
         def expression_call_noargs(state, p):
             # Cannot return the value of a function if it isn't yet defined
-            if self.syntax is True:
-                return [Node("IDENTIFIER", p[0]), Node("("), Node(")")]
-            return CallFunction(name=p[0].getstr(), args=None, state=state)
+            return CallFunction(name=p[0].getstr(), args=None, state=state, token=p[0])
 
         @self.pg.production('expression : const')
         def expression_const(state, p):
-            if self.syntax is True:
-                return [Node("const", p[0])]
             return p[0]
 
         @self.pg.production('const : FLOAT')
         def constant_float(state, p):
-            if self.syntax is True:
-                return [Node("FLOAT", p[0])]
-            return Float(p[0].getstr(), state)
+            return Float(p[0].getstr(), state, token=p[0])
 
         @self.pg.production('const : BOOLEAN')
         def constant_boolean(state, p):
-            if self.syntax is True:
-                return [Node("BOOLEAN", p[0])]
-            return Boolean(p[0].getstr(), state)
+            return Boolean(p[0].getstr(), state, token=p[0])
 
         @self.pg.production('const : INTEGER')
         def constant_integer(state, p):
-            if self.syntax is True:
-                return [Node("INTEGER", p[0])]
-            return Integer(p[0].getstr(), state)
+            return Integer(p[0].getstr(), state, token=p[0])
 
         @self.pg.production('const : STRING')
         def constant_string(state, p):
-            if self.syntax is True:
-                return [Node("STRING", p[0])]
-            return String(p[0].getstr().strip('"\''), state)
+            return String(p[0].getstr().strip('"\''), state, token=p[0])
 
         @self.pg.production('const : PI')
         def constant_pi(state, p):
-            if self.syntax is True:
-                return [Node("PI", p[0])]
-            return ConstantPI(p[0].getstr(), state)
+            return ConstantPI(p[0].getstr(), state, token=p[0])
 
         @self.pg.production('const : E')
         def constant_e(state, p):
-            if self.syntax is True:
-                return [Node("E", p[0])]
-            return ConstantE(p[0].getstr(), state)
+            return ConstantE(p[0].getstr(), state, token=p[0])
 
         @self.pg.error
         def error_handle(state, token):
@@ -0,0 +1,61 @@
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class Instrumentation:
+    """Collect per phase timings and counters of one compile pipeline run.
+
+    Wrap each phase in `with instrumentation.phase(name):`, pass the token
+    stream through count_tokens() and hand the object to
+    Parser(instrumentation=...) to count reductions by production.
+    """
+
+    def __init__(self):
+        self.phases = {}  # Phase name -> {"seconds", "net_blocks", "calls"}
+        self.tokens = Counter()
+        self.reductions = Counter()
+
+    @contextmanager
+    def phase(self, name):
+        # Net change of the allocated memory blocks, not an allocation count: what a phase frees cancels out.
+        # sys.getallocatedblocks() is cheap unlike tracemalloc !
+        blocks = sys.getallocatedblocks()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            seconds = time.perf_counter() - start
+            record = self.phases.setdefault(name, {"seconds": 0.0, "net_blocks": 0, "calls": 0})
+            record["seconds"] += seconds
+            record["net_blocks"] += sys.getallocatedblocks() - blocks
+            record["calls"] += 1
+
+    def count_tokens(self, tokens):
+        counter = self.tokens
+        for token in tokens:
+            counter[token.gettokentype()] += 1
+            yield token
+
+    def counted(self, rule, function):
+        # Wrap a production callback so every reduction by `rule` is counted !
+        reductions = self.reductions
+
+        def reduce(state, p):
+            reductions[rule] += 1
+            return function(state, p)
+        return reduce
+
+    def summary(self):
+        lines = ["%-24s %12s %12s %6s" % ("phase", "seconds", "net blocks", "calls")]
+        for name, record in self.phases.items():
+            lines.append("%-24s %12.6f %12d %6d" % (name, record["seconds"], record["net_blocks"],
+                                                    record["calls"]))
+        lines.append("tokens: %d" % sum(self.tokens.values()))
+        for kind, count in self.tokens.most_common():
+            lines.append("    %-20s %8d" % (kind, count))
+        lines.append("reductions: %d" % sum(self.reductions.values()))
+        for rule, count in self.reductions.most_common():
+            lines.append("    %-50s %8d" % (rule, count))
+        return "\n".join(lines)
@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import socket
+import sys
+import time
+import warnings
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .lexer import Lexer
+from .parser import Parser, ParserState
+from .JSONparsedTree import Node, ParsedTree, iterencode
+from .optimizer import ConstantFolder
+from .typecheck import TypeInference
+from .budget import Budget
+from .batch import BACKENDS, PASSES, InputFeed, prepare, is_plain
+from .output import MemorySink
+from .cli import describe
+from .codegen import program_key
+
+OPERATIONS = ("compile", "eval", "dump")
+# Longest request line (i.e. source text) the server reads !
+LINE_LIMIT = 16 << 20
+
+# Built once per worker process by setup(), every request handled by the worker reuses them !
+_lexer = None
+_parser = None
+_limits = None
+_fast = True
+
+
+def setup(fast=True, limits=None):
+    global _lexer, _parser, _limits, _fast
+    warnings.simplefilter("ignore")
+    sys.stdin = open(os.devnull)  # Only the request's inputs feed input() !
+    _lexer = Lexer(fast=fast).build()
+    _fast = fast
+    _parser = Parser().build()
+    _limits = limits
+
+
+def tree(root):
+    # JSON text of a tree, encoded without recursion so deep programs don't overflow the stack !
+    return "".join(iterencode(ParsedTree(root), compact=True))
+
+
+def handle(request):
+    """Run one compile, eval or dump request in a fresh ParserState, in a worker process.
+
+    Returns the fields of the response and the trees (as JSON text) of a dump.
+    """
+    op = request["op"]
+    state = ParserState()
+    sink = state.output = MemorySink()
+    state.input = InputFeed(request.get("inputs") or ())
+    if _limits:
+        state.budget = Budget(**_limits)
+    response = {"ok": False, "error": None}
+    trees = {}
+    try:
+        main = _parser.parse(_lexer.lex(request["source"]), state=state)
+        if op == "dump":
+            trees["syntax"] = tree(Node("main", main.syntax()))
+            semantic = Node("main")
+            main.eval(semantic)
+            trees["semantic"] = tree(semantic)
+        elif op == "eval":
+            prepare(state, main, request.get("backend") or "python", program_key(request["source"], _fast, PASSES))()
+        else:
+            TypeInference(state).infer(ConstantFolder(state).fold(main))
+        response["ok"] = True
+    except Exception as e:
+        response["error"] = describe(e)
+    response["output"] = sink.getvalue()
+    if op != "compile":
+        response["variables"] = {name: value for name, value in state.variables.items() if is_plain(value)}
+    if state.budget is not None:
+        response["usage"] = state.budget.usage()
+    return response, trees
+
+
+def encode(response, trees=None):
+    # The trees are already JSON, they're spliced in instead of being parsed & encoded again !
+    text = json.dumps(response)
+    if trees:
+        text = text[:-1] + "".join(', "%s": %s' % item for item in trees.items()) + "}"
+    return text + "\n"
+
+
+def percentile(values, p):
+    # Nearest-rank percentile of sorted values !
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Server:
+    """Local compile & eval service keeping a warm lexer & parser in every worker process.
+
+    Requests and responses are JSON objects, one per line, e.g.
+    {"id": 1, "op": "eval", "source": "print(1);", "inputs": [5], "backend": "python"}
+    with op one of compile (lex, parse & type check), eval, dump (syntax and
+    semantic trees) or stats. A connection can pipeline requests: they run
+    concurrently, up to max_pipeline of them per connection, and their
+    responses come back in request order. At most max_concurrency requests
+    run on the pool at once, the others wait for a slot. Every request gets
+    its own ParserState, and a Budget when limits are given. When a worker
+    dies (e.g. killed by the OOM killer), the requests running on the pool
+    fail and the pool is replaced by a new one.
+    """
+
+    def __init__(self, workers=None, max_concurrency=None, max_pipeline=64, limits=None, fast=True, window=10000):
+        self.workers = workers or os.cpu_count() or 1
+        self.fast = fast
+        self.limits = limits
+        self.pool = self.start()
+        self.restarts = 0
+        self.slots = asyncio.Semaphore(max_concurrency or self.workers)
+        self.max_pipeline = max_pipeline
+        self.latencies = {op: deque(maxlen=window) for op in OPERATIONS}  # Seconds of the last `window` requests
+        self.requests = Counter()
+        self.errors = Counter()
+        self.connections = 0
+        self.running = 0
+        self.waiting = 0
+        self.started = time.time()
+
+    def start(self):
+        return ProcessPoolExecutor(self.workers, initializer=setup, initargs=(self.fast, self.limits))
+
+    def restart(self, pool):
+        # Every request still running on the broken pool fails with it, only the first one replaces it !
+        if self.pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = self.start()
+            self.restarts += 1
+
+    async def warm(self):
+        # Start every worker now, so the first requests don't pay for building the lexer & parser !
+        loop = asyncio.get_running_loop()
+        request = {"op": "compile", "source": "print(1);"}
+        await asyncio.gather(*(loop.run_in_executor(self.pool, handle, request) for _ in range(self.workers)))
+
+    async def serve(self, host="127.0.0.1", port=8765, unix=None):
+        await self.warm()
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.connection, path=unix, limit=LINE_LIMIT)
+        else:
+            server = await asyncio.start_server(self.connection, host, port, limit=LINE_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def connection(self, reader, writer):
+        self.connections += 1
+        # Responses of the pipelined requests in request order, bounded so a client can't queue unlimited work !
+        pending = asyncio.Queue(self.max_pipeline)
+        responder = asyncio.ensure_future(self.respond(pending, writer))
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # Longer than LINE_LIMIT, the rest of the stream can't be framed anymore !
+                    await pending.put(self.done(encode({"id": None, "ok": False, "error": "Request too long"})))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await pending.put(asyncio.ensure_future(self.request(line)))
+        except ConnectionError:
+            pass
+        finally:
+            await pending.put(None)
+            await responder
+            self.connections -= 1
+            writer.close()
+
+    async def respond(self, pending, writer):
+        while True:
+            response = await pending.get()
+            if response is None:
+                break
+            text = await response
+            try:
+                writer.write(text.encode())
+                await writer.drain()
+            except ConnectionError:
+                pass  # Client went away, the remaining requests still finish so their slots are freed !
+
+    def done(self, text):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(text)
+        return future
+
+    async def request(self, line):
+        start = time.perf_counter()
+        try:
+            request = json.loads(line)
+            op = request.get("op")
+        except (ValueError, AttributeError) as e:
+            return encode({"id": None, "ok": False, "error": describe(e)})
+        if op == "stats":
+            return encode({"id": request.get("id"), "ok": True, "stats": self.stats()})
+        if op not in OPERATIONS or not isinstance(request.get("source"), str) or (
+                request.get("backend") not in (None,) + BACKENDS):
+            return encode({"id": request.get("id"), "ok": False,
+                           "error": "Expected a source and an op in %s" % (OPERATIONS + ("stats",),)})
+        self.waiting += 1
+        async with self.slots:
+            self.waiting -= 1
+            self.running += 1
+            pool = self.pool
+            try:
+                response, trees = await asyncio.get_running_loop().run_in_executor(pool, handle, request)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):  # A worker died, e.g. killed by the OOM killer !
+                    self.restart(pool)
+                response, trees = {"ok": False, "error": describe(e)}, {}
+            finally:
+                self.running -= 1
+        seconds = time.perf_counter() - start
+        self.latencies[op].append(seconds)
+        self.requests[op] += 1
+        self.errors[op] += not response["ok"]
+        response["id"] = request.get("id")
+        response["seconds"] = round(seconds, 6)
+        return encode(response, trees)
+
+    def stats(self):
+        operations = {}
+        for op in OPERATIONS:
+            latencies = sorted(self.latencies[op])
+            operations[op] = {"requests": self.requests[op], "errors": self.errors[op]}
+            if latencies:
+                # Milliseconds, over the last `window` requests !
+                operations[op].update({"p%d" % p: round(percentile(latencies, p) * 1000, 3) for p in (50, 90, 99)})
+                operations[op]["max"] = round(latencies[-1] * 1000, 3)
+        return {"uptime": round(time.time() - self.started, 3), "workers": self.workers, "restarts": self.restarts,
+                "connections": self.connections, "running": self.running, "waiting": self.waiting,
+                "operations": operations}
+
+
+class Client:
+    """Blocking client of the Server, send() several requests then receive() their responses to pipeline them."""
+
+    def __init__(self, address=("127.0.0.1", 8765)):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.file = self.socket.makefile("rwb")
+        self.ids = itertools.count(1)
+
+    def send(self, op, source=None, **fields):
+        request = dict(fields, id=next(self.ids), op=op, source=source)
+        self.file.write((json.dumps(request) + "\n").encode())
+        self.file.flush()
+        return request["id"]
+
+    def receive(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        return json.loads(line)
+
+    def call(self, op, source=None, **fields):
+        self.send(op, source, **fields)
+        return self.receive()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+async def main(options):
+    limits = {name: value for name, value in (("max_steps", options.max_steps), ("seconds", options.timeout),
+                                              ("max_depth", options.max_depth), ("max_output", options.max_output))
+              if value is not None}
+    server = Server(options.workers, options.max_concurrency, options.max_pipeline, limits)
+    try:
+        await server.serve(options.host, options.port, options.unix)
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description="Serve compile, eval & dump requests with a warm lexer & parser.")
+    arguments.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    arguments.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    arguments.add_argument("--unix", metavar="PATH", help="listen on this Unix socket instead of TCP")
+    arguments.add_argument("--workers", "-j", type=int, default=None, help="worker processes (default: every core)")
+    arguments.add_argument("--max-concurrency", type=int, default=None,
+                           help="requests running at once (default: the number of workers)")
+    arguments.add_argument("--max-pipeline", type=int, default=64, help="requests in flight per connection")
+    arguments.add_argument("--max-steps", type=int, help="fail a run after executing this many statements")
+    arguments.add_argument("--timeout", type=float, help="fail a run after this many seconds")
+    arguments.add_argument("--max-depth", type=int, help="fail a run nesting more function calls than this")
+    arguments.add_argument("--max-output", type=int, help="fail a run printing more characters than this")
+    try:
+        asyncio.run(main(arguments.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,220 @@
+import math
+from .AbstractSyntaxTree import *
+from .errors import *
+
+# Static types, UNKNOWN when the value is only known at run time (input(), arrays, host bound variables) !
+INT, FLOAT, BOOL, STRING, UNKNOWN = "int", "float", "bool", "string", "unknown"
+NUMERIC = (INT, FLOAT)
+ARITHMETIC = (INT, FLOAT, BOOL)  # True + 1 == 2, bool is a number for the operators but not for the builtins !
+CONSTANT_TYPES = {Integer: INT, Float: FLOAT, ConstantPI: FLOAT, ConstantE: FLOAT, Boolean: BOOL, String: STRING}
+
+
+def join(a, b):
+    # None is "no value seen yet", the type of a variable assigned at several places is their common type !
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a if a == b else UNKNOWN
+
+
+class NumericAbsolute(Absolute):
+    __slots__ = ()
+
+    def run(self):
+        return abs(self.expression.run())
+
+    def apply(self, value):
+        return abs(value)
+
+
+class NumericSin(Sin):
+    __slots__ = ()
+
+    def run(self):
+        return round(math.sin(self.expression.run()), self.roundOffDigits)
+
+    def apply(self, value):
+        return round(math.sin(value), self.roundOffDigits)
+
+
+class NumericCos(Cos):
+    __slots__ = ()
+
+    def run(self):
+        return round(math.cos(self.expression.run()), self.roundOffDigits)
+
+    def apply(self, value):
+        return round(math.cos(value), self.roundOffDigits)
+
+
+class NumericTan(Tan):
+    __slots__ = ()
+
+    def run(self):
+        return round(math.tan(self.expression.run()), self.roundOffDigits)
+
+    def apply(self, value):
+        return round(math.tan(value), self.roundOffDigits)
+
+
+class NumericPow(Pow):
+    __slots__ = ()
+
+    def run(self):
+        return math.pow(self.expression.run(), self.expression2.run())
+
+    def apply(self, value, value2):
+        return math.pow(value, value2)
+
+
+class BooleanNot(Not):
+    __slots__ = ()
+
+    def run(self):
+        return not self.expression.run()
+
+    def apply(self, value):
+        return not value
+
+
+# Check-free version of a node, used once the types of its arguments are known to be right !
+SPECIALIZED = {Absolute: NumericAbsolute, Sin: NumericSin, Cos: NumericCos, Tan: NumericTan, Pow: NumericPow,
+               Not: BooleanNot}
+
+
+class TypeInference:
+    """Infer the static type of every expression, reject mistyped programs and specialize the typed nodes.
+
+    Runs between parsing (or folding) and evaluation. Variables are
+    immutable, so the type of a variable is the common type of the values
+    of its `let`s, and the type of a call the one of the function's last
+    statement; both are computed up to a fixpoint. Mistyped expressions
+    (sin("x"), not 1, "a" - 1, ...) raise StaticTypeError, even when they
+    wouldn't be reached at run time. Builtins whose argument types are known
+    are swapped for the check-free Numeric*/BooleanNot nodes, the others keep
+    the typed dispatch of their apply().
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.variables = {}  # slot -> type of the values assigned to it
+        self.returns = {}  # function name -> type of its result
+        self.final = False
+        self.specialized = 0
+
+    def infer(self, main):
+        blocks = [main.program] + [function.block for function in self.state.functions.values()]
+        changed = True
+        while changed:
+            # Types only ever go up None -> type -> UNKNOWN, so this ends after a few rounds !
+            before = (dict(self.variables), dict(self.returns))
+            for name, function in self.state.functions.items():
+                self.returns[name] = join(self.returns.get(name), self.visit(function.block))
+            self.visit(main.program)
+            changed = before != (self.variables, self.returns)
+        # Last round with every type settled: errors are raised & nodes specialized only now !
+        self.final = True
+        for block in blocks:
+            self.visit(block)
+        return main
+
+    def visit(self, node):
+        if isinstance(node, (Program, Block)):
+            result = UNKNOWN
+            for statement in node.statements:
+                result = self.visit(statement)
+            return result
+        elif isinstance(node, StatementFull):
+            return self.visit(node.statement)
+        elif isinstance(node, Statement):
+            return self.visit(node.expression)
+        elif isinstance(node, ExpressParenthesis):
+            return self.visit(node.expression)
+        elif isinstance(node, Constant):
+            return CONSTANT_TYPES.get(type(node), UNKNOWN)
+        elif isinstance(node, Variable):
+            return self.unknown(self.variables.get(node.slot))
+        elif isinstance(node, CallFunction):
+            return self.unknown(self.returns.get(node.name))
+        elif isinstance(node, Assignment):
+            value = self.visit(node.right)
+            if isinstance(node.left, Variable):
+                self.variables[node.left.slot] = join(self.variables.get(node.left.slot), value)
+            return value
+        elif isinstance(node, If):
+            self.visit(node.condition)
+            body = self.visit(node.body)
+            if node.else_body is None:
+                return UNKNOWN  # None when the condition is false !
+            return join(body, self.visit(node.else_body))
+        elif isinstance(node, (Print, Input)):
+            if node.value is not None:
+                self.visit(node.value)
+            return UNKNOWN  # print() gives None, input() a float or a string depending on what's typed !
+        elif isinstance(node, Array):
+            for element in node.elements:
+                if self.visit(element) == STRING:
+                    self.error("Cannot create an array of not numerical values")
+            return UNKNOWN
+        elif isinstance(node, BinaryOp):
+            return self.binary(node, self.visit(node.left), self.visit(node.right))
+        elif isinstance(node, Pow):
+            types = (self.visit(node.expression), self.visit(node.expression2))
+            if BOOL in types or STRING in types:
+                self.error("Cannot pow() not numerical values (%s, %s)" % types)
+            return self.builtin(node, types, FLOAT)
+        elif isinstance(node, BaseFunction):
+            value = self.visit(node.expression)
+            if value in (BOOL, STRING):
+                self.error("Cannot %s() not numerical values (%s)" % (node.keyword.lower()[:3], value))
+            return self.builtin(node, (value,), value if isinstance(node, Absolute) else FLOAT)
+        elif isinstance(node, Not):
+            value = self.visit(node.expression)
+            if value in (INT, FLOAT, STRING):
+                self.error("Cannot 'not' that (%s)" % value)
+            if value == BOOL:
+                self.specialize(node)
+                return BOOL
+            return value if value is None else UNKNOWN  # A boolean array gives an array !
+        return UNKNOWN  # FunctionDeclaration, evaluates to itself !
+
+    def binary(self, node, left, right):
+        if left is None or right is None:
+            return None
+        if isinstance(node, (And, Or)):
+            return join(left, right)  # Either operand is the result !
+        if UNKNOWN in (left, right):
+            return UNKNOWN  # May be an array, whose operators work elementwise !
+        if isinstance(node, (Equal, NotEqual)):
+            return BOOL
+        if left in ARITHMETIC and right in ARITHMETIC:
+            if isinstance(node, (Sum, Sub, Mul)):
+                return FLOAT if FLOAT in (left, right) else INT
+            return FLOAT if isinstance(node, Div) else BOOL
+        if left == right == STRING and not isinstance(node, (Sub, Mul, Div)):
+            return STRING if isinstance(node, Sum) else BOOL
+        if isinstance(node, Mul) and STRING in (left, right) and (left in (INT, BOOL) or right in (INT, BOOL)):
+            return STRING  # "ab" * 3 !
+        self.error("Cannot apply %s to %s and %s" % (type(node).__name__, left, right))
+
+    def builtin(self, node, types, result):
+        if None in types:
+            return None
+        if all(value in NUMERIC for value in types):
+            self.specialize(node)
+            return result
+        return UNKNOWN
+
+    def specialize(self, node):
+        if self.final and type(node) in SPECIALIZED:
+            node.__class__ = SPECIALIZED[type(node)]
+            self.specialized += 1
+
+    def unknown(self, value):
+        # Not assigned anywhere (yet): bound by the host or undefined, only known at run time !
+        return value if value is not None or not self.final else UNKNOWN
+
+    def error(self, message):
+        if self.final:
+            raise StaticTypeError(message + " !")